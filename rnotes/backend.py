@@ -0,0 +1,235 @@
+"""Where the runner gets git output and files from.
+
+LocalBackend is the real repository.  RecordingBackend does the same, and
+saves everything it returned to a capture file; ReplayBackend serves a
+capture with no repository present, so a slow run can be profiled offline.
+"""
+import os
+import os.path
+import gzip
+import json
+import shutil
+import subprocess
+import threading
+import logging
+
+from rnotes.refs import find_git_dirs, read_tags, UnsupportedRepo
+
+log = logging.getLogger("rnotes")
+
+CAPTURE_VERSION = 1
+
+
+class LocalBackend:
+    """Git and files in the current directory."""
+
+    def __init__(self):
+        self.__git = shutil.which("git")
+
+    def git(self, *args, stdin=None):
+        """Shell git with args."""
+        cmd = [self.__git] + list(args)
+        ret = subprocess.run(
+            cmd, check=True, stdout=subprocess.PIPE, input=stdin, encoding="utf8"
+        )
+        return ret.stdout
+
+    def git_lines(self, *args):
+        """Shell git with args, yield its output a line at a time as it runs."""
+        cmd = [self.__git] + list(args)
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, encoding="utf8") as proc:
+            yield from proc.stdout
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+    def read_tags(self):
+        """Return {tag: (sha, peeled)} read straight from the repo refs."""
+        _, common_dir = find_git_dirs()
+        return read_tags(common_dir)
+
+    def read_file(self, path):
+        """Return the contents of a text file."""
+        with open(path, encoding="utf8") as fh:
+            return fh.read()
+
+    def write_file(self, path, text):
+        """Write a text file, creating its folder if needed."""
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(path, "w", encoding="utf8") as fh:
+            fh.write(text)
+
+    def isfile(self, path):
+        """True if path is a file."""
+        return os.path.isfile(path)
+
+    def exists(self, path):
+        """True if path exists."""
+        return os.path.exists(path)
+
+    def mtime(self, path):
+        """Modification time of path."""
+        return os.stat(path).st_mtime
+
+    def listdir(self, path):
+        """Names in a folder."""
+        return os.listdir(path)
+
+    def close(self):
+        """Called when the runner is done."""
+
+
+class RecordingBackend(LocalBackend):
+    """LocalBackend that saves everything it returns to a capture file."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.lock = threading.Lock()
+        self.capture = {"version": CAPTURE_VERSION, "git": [], "tags": None}
+        for kind in ("files", "isfile", "exists", "mtime", "listdir"):
+            self.capture[kind] = {}
+
+    def _save(self, kind, key, value):
+        with self.lock:
+            self.capture[kind][key] = value
+        return value
+
+    def git(self, *args, stdin=None):
+        try:
+            out = super().git(*args, stdin=stdin)
+        except subprocess.CalledProcessError as e:
+            with self.lock:
+                self.capture["git"].append([list(args), stdin, None, e.returncode])
+            raise
+        with self.lock:
+            self.capture["git"].append([list(args), stdin, out, 0])
+        return out
+
+    def git_lines(self, *args):
+        lines = []
+        try:
+            for line in super().git_lines(*args):
+                lines.append(line)
+                yield line
+        except subprocess.CalledProcessError as e:
+            with self.lock:
+                self.capture["git"].append([list(args), None, None, e.returncode])
+            raise
+        # same as a git() call, so either one replays it
+        with self.lock:
+            self.capture["git"].append([list(args), None, "".join(lines), 0])
+
+    def read_tags(self):
+        try:
+            tags = super().read_tags()
+        except UnsupportedRepo:
+            self.capture["tags"] = None
+            raise
+        self.capture["tags"] = tags
+        return tags
+
+    def read_file(self, path):
+        try:
+            return self._save("files", path, super().read_file(path))
+        except FileNotFoundError:
+            self._save("files", path, None)
+            raise
+
+    def isfile(self, path):
+        return self._save("isfile", path, super().isfile(path))
+
+    def exists(self, path):
+        return self._save("exists", path, super().exists(path))
+
+    def mtime(self, path):
+        return self._save("mtime", path, super().mtime(path))
+
+    def listdir(self, path):
+        return self._save("listdir", path, super().listdir(path))
+
+    def close(self):
+        with gzip.open(self.path, "wt", encoding="utf8") as fh:
+            json.dump(self.capture, fh, separators=(",", ":"))
+        log.info(
+            "recorded %d git calls, %d files to %s",
+            len(self.capture["git"]),
+            len(self.capture["files"]),
+            self.path,
+        )
+
+
+class ReplayBackend:
+    """Serves a capture saved by RecordingBackend, without touching the repo."""
+
+    def __init__(self, path):
+        with gzip.open(path, "rt", encoding="utf8") as fh:
+            self.capture = json.load(fh)
+        version = self.capture.get("version")
+        assert version == CAPTURE_VERSION, "%s: not an rnotes capture" % path
+        self.lock = threading.Lock()
+        self.calls = {}
+        for args, stdin, out, code in self.capture["git"]:
+            self.calls.setdefault(self._key(args, stdin), []).append((out, code))
+
+    @staticmethod
+    def _key(args, stdin):
+        return json.dumps([list(args), stdin])
+
+    def _get(self, kind, key):
+        try:
+            return self.capture[kind][key]
+        except KeyError:
+            raise AssertionError("not in capture: %s %s" % (kind, key)) from None
+
+    def git(self, *args, stdin=None):
+        """Return what git returned for the same args when recorded."""
+        with self.lock:
+            results = self.calls.get(self._key(args, stdin))
+            assert results, "not in capture: git %s" % " ".join(args)
+            # same command more than once: in order, then the last one again
+            out, code = results.pop(0) if len(results) > 1 else results[0]
+        if code:
+            raise subprocess.CalledProcessError(code, ["git", *args])
+        return out
+
+    def git_lines(self, *args):
+        """Recorded git output, a line at a time."""
+        yield from self.git(*args).splitlines(keepends=True)
+
+    def read_tags(self):
+        """Return the tags read when recorded."""
+        tags = self.capture["tags"]
+        if tags is None:
+            raise UnsupportedRepo("not in capture")
+        return {tag: tuple(val) for tag, val in tags.items()}
+
+    def read_file(self, path):
+        """Return a file's contents as recorded."""
+        text = self._get("files", path)
+        if text is None:
+            raise FileNotFoundError(path)
+        return text
+
+    def write_file(self, path, text):
+        """Nothing is written during a replay."""
+
+    def isfile(self, path):
+        """Recorded os.path.isfile."""
+        return self._get("isfile", path)
+
+    def exists(self, path):
+        """Recorded os.path.exists."""
+        return self._get("exists", path)
+
+    def mtime(self, path):
+        """Recorded modification time."""
+        return self._get("mtime", path)
+
+    def listdir(self, path):
+        """Recorded folder listing."""
+        return self._get("listdir", path)
+
+    def close(self):
+        """Nothing to do."""
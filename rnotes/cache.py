@@ -0,0 +1,187 @@
+"""Share computed release notes through a git notes ref.
+
+Each finalized release is stored as a git note on its tagged commit, holding
+the note files that belong to it (with their blob ids) and the parsed entries.
+Entries are checked against the blobs when loaded, so a record can't say more
+than the notes do.  Fetching the ref gives a fresh clone the same cache.
+"""
+import os
+import os.path
+import tempfile
+from collections import Counter, defaultdict
+import logging
+
+import yaml
+
+from rnotes.refs import TAGS_PREFIX
+
+log = logging.getLogger("rnotes")
+
+NOTES_REF = "refs/notes/rnotes"
+
+
+class NotesCache:
+    """Read and write release records under NOTES_REF."""
+
+    def __init__(self, runner):
+        self.runner = runner
+
+    def git(self, *args, **kwargs):
+        """Shell git, through the runner."""
+        return self.runner.git(*args, **kwargs)
+
+    def get_blobs(self):
+        """Return {path: blob id} for notes in the index that match the worktree."""
+        blobs = {}
+        for ent in self.git("ls-files", "-s", "--", self.runner.notes_dir).split("\n"):
+            if "\t" in ent:
+                info, path = ent.split("\t", 1)
+                blobs[path] = info.split()[1]
+        status = self.git("status", "--porcelain", "--", self.runner.notes_dir)
+        for porc in status.split("\n"):
+            blobs.pop(porc[3:].strip(), None)
+        return blobs
+
+    def get_commits(self, tags):
+        """Return {tag: commit id} for tags, in one git call."""
+        out = self.git(
+            "cat-file",
+            "--batch-check=%(objectname)",
+            stdin="".join(TAGS_PREFIX + tag + "^{commit}\n" for tag in tags),
+        )
+        return {
+            tag: ent
+            for tag, ent in zip(tags, out.split("\n"))
+            if not ent.endswith(" missing")
+        }
+
+    def get_tree(self):
+        """Return {commit id: blob id} of the notes ref, empty if there isn't one."""
+        if not self.git("for-each-ref", NOTES_REF).strip():
+            return {}
+        tree = {}
+        for ent in self.git("ls-tree", "-r", NOTES_REF).split("\n"):
+            if "\t" in ent:
+                info, path = ent.split("\t", 1)
+                tree[path.replace("/", "")] = info.split()[2]
+        return tree
+
+    def read_blobs(self, blobs):
+        """Return {blob id: text} for blobs, in one git call."""
+        if not blobs:
+            return {}
+        out = self.git("cat-file", "--batch", stdin="".join(b + "\n" for b in blobs))
+        data = out.encode("utf8")
+        ret = {}
+        pos = 0
+        while pos < len(data):
+            eol = data.index(b"\n", pos)
+            sha, _, size = data[pos:eol].decode().split()
+            start = eol + 1
+            end = start + int(size)
+            ret[sha] = data[start:end].decode("utf8")
+            pos = end + 1
+        return ret
+
+    def load(self, tags):
+        """Return {tag: record} for the oldest tags (given oldest first) the cache covers.
+
+        Stops at the first tag without a valid record: every tag after that
+        one has to come from the log anyway.
+        """
+        tree = self.get_tree()
+        if not tree:
+            return {}
+        commits = self.get_commits(tags)
+        wanted = [tree[commits[tag]] for tag in tags if commits.get(tag) in tree]
+        data = self.read_blobs(sorted(set(wanted)))
+        blobs = self.get_blobs()
+
+        cached = {}
+        for tag in tags:
+            commit = commits.get(tag)
+            rec = (yaml.safe_load(data.get(tree.get(commit), "")) or {}).get(tag)
+            if not rec or rec.get("commit") != commit:
+                log.debug("cache: no record for %s", tag)
+                break
+            stale = [f for f, b in rec["files"].items() if blobs.get(f) != b]
+            if stale:
+                log.debug("cache: %s changed since %s was published", stale, tag)
+                break
+            cached[tag] = rec
+
+        # the files are the repo's own, the entries have to come from them
+        texts = self.read_blobs(
+            sorted({b for rec in cached.values() for b in rec["files"].values()})
+        )
+        for num, (tag, rec) in enumerate(cached.items()):
+            if not self.verify(tag, rec, texts):
+                log.debug("cache: entries for %s don't match its notes", tag)
+                cached = dict(list(cached.items())[:num])
+                break
+        log.debug("cache: %d of %d releases", len(cached), len(tags))
+        return cached
+
+    def verify(self, tag, rec, texts):
+        """True if rec's entries are what its note files parse to."""
+        notes = defaultdict(lambda: defaultdict(lambda: []))
+        for file, blob in rec["files"].items():
+            self.runner.parse_note(tag, file, texts[blob], {}, notes)
+        have = Counter(
+            (sec, ent["note"]) for sec, ents in rec["notes"].items() for ent in ents
+        )
+        want = Counter(
+            (sec, ent["note"]) for sec, ents in notes[tag].items() for ent in ents
+        )
+        return have == want
+
+    def publish(self, tags):
+        """Store a record for each of tags (finalized releases) under NOTES_REF."""
+        runner = self.runner
+        commits = self.get_commits(tags)
+        blobs = self.get_blobs()
+
+        files = {tag: [] for tag in tags}
+        for tag, _ct, _cname, _hsh, file in runner.logs:
+            if tag in files and runner.backend.exists(file):
+                assert file in blobs, "%s: commit or stash note changes first" % file
+                files[tag].append(file)
+
+        by_commit = {}
+        for tag in tags:
+            rec = runner.cached.get(tag)
+            if not rec:
+                notes = runner.notes.get(tag, {})
+                rec = {
+                    "commit": commits[tag],
+                    "files": {file: blobs[file] for file in files[tag]},
+                    "notes": {sec: list(ents) for sec, ents in notes.items()},
+                }
+            by_commit.setdefault(commits[tag], {})[tag] = rec
+
+        self.write(by_commit)
+        print("Published:", NOTES_REF, "(%d releases)" % len(tags))
+
+    def write(self, by_commit):
+        """Add {commit id: records} to the notes ref, as one new notes commit."""
+        tree = self.get_tree()
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for commit, recs in by_commit.items():
+                path = os.path.join(tmp, commit)
+                with open(path, "w", encoding="utf8") as fh:
+                    yaml.safe_dump(recs, fh)
+                paths.append(path)
+            out = self.git("hash-object", "-w", "--stdin-paths", stdin="\n".join(paths))
+        tree.update(zip(by_commit, out.split()))
+
+        tree_id = self.git(
+            "mktree",
+            stdin="".join("100644 blob %s\t%s\n" % (b, c) for c, b in tree.items()),
+        ).strip()
+        parent = self.git("for-each-ref", "--format=%(objectname)", NOTES_REF).strip()
+        parent = ["-p", parent] if parent else []
+        commit = self.git(
+            "commit-tree", tree_id, *parent, "-m", "rnotes: publish cache"
+        ).strip()
+        self.git("update-ref", NOTES_REF, commit)
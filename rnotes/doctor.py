@@ -0,0 +1,179 @@
+"""rnotes --doctor: time each phase on this repo, look for slow configurations."""
+import io
+import os.path
+import time
+
+from rnotes.cache import NOTES_REF
+
+# more notes than this in one folder makes --lint and git status crawl
+MAX_FLAT_NOTES = 1000
+
+# a release history this long is worth publishing to the notes cache
+MIN_CACHE_TAGS = 20
+
+# releases to keep when suggesting a newer earliest_version
+KEEP_RELEASES = 50
+
+
+class Doctor:
+    """Measure a runner's phases, and suggest config changes."""
+
+    def __init__(self, runner):
+        self.runner = runner
+        self.timings = {}
+        self.counts = {}
+        self.findings = []
+
+    def timed(self, name, func, *args):
+        """Run func, remember how long it took."""
+        start = time.perf_counter()
+        ret = func(*args)
+        self.timings[name] = time.perf_counter() - start
+        return ret
+
+    def finding(self, problem, suggestion, saving):
+        """Add a problem, what to do about it, and what it should save."""
+        self.findings.append((problem, suggestion, saving))
+
+    def run(self):
+        """Measure, check, print the results."""
+        r = self.runner
+        self.timed("get_filters", r.get_filters)
+        self.timed("get_tags", r.get_tags)
+        self.timed("get_start_from_end", r.get_start_from_end)
+        self.timed("get_cached", r.get_cached)
+        self.timed("get_logs", r.get_logs)
+        self.timed("get_notes", r.get_notes)
+        self.timed("get_report", r.get_report, io.StringIO())
+
+        refs = r.get_tag_refs()
+        matching = [tag for tag in refs if r.tag_re.match(tag)]
+        vers = r.ver_end
+        if r.ver_start and r.ver_start != "TAIL":
+            vers = r.ver_start + ".." + r.ver_end
+        self.counts["tags"] = len(refs)
+        self.counts["release tags"] = len(matching)
+        self.counts["notes in range"] = len(r.logs)
+        self.counts["commits in range"] = int(r.git("rev-list", "--count", vers))
+        self.counts["commits"] = int(r.git("rev-list", "--count", "HEAD"))
+
+        self.check_earliest(refs)
+        self.check_tag_re(matching)
+        self.check_commit_graph()
+        self.check_notes_dir()
+        self.check_cache()
+        self.print()
+
+    def check_earliest(self, refs):
+        """earliest_version should be a tag, or get_tags can't stop early."""
+        r = self.runner
+        if not r.earliest or r.earliest in refs or not r.tags:
+            return
+        tags = r.tags
+        keep = tags[-KEEP_RELEASES] if len(tags) > KEEP_RELEASES else None
+        suggestion = "set earliest_version to an existing release tag"
+        saving = "get_tags stops at that tag instead of the oldest release"
+        if keep:
+            suggestion = "earliest_version: %s  (keeps the last %d releases)" % (
+                keep,
+                KEEP_RELEASES,
+            )
+            dropped = (len(tags) - KEEP_RELEASES) / len(tags)
+            saving = "~%.0f%% of tag scanning (%.3fs), %d fewer releases" % (
+                100 * dropped,
+                dropped * self.timings["get_tags"],
+                len(tags) - KEEP_RELEASES,
+            )
+        self.finding(
+            "earliest_version %r is not a tag, so every release tag is scanned"
+            % r.earliest,
+            suggestion,
+            saving,
+        )
+
+    def check_tag_re(self, matching):
+        """release_tag_re should match releases, not nightly or other builds."""
+        r = self.runner
+        # the regex only matched a prefix: "1.2.3-nightly.20220901" style tags
+        partial = [tag for tag in matching if r.tag_re.match(tag).end() != len(tag)]
+        if not partial or len(partial) * 5 < len(matching):
+            return
+        regex = r.version_regex
+        if not regex.endswith("$"):
+            regex += "$"
+        frac = len(partial) / len(matching)
+        self.finding(
+            "release_tag_re %r matches %d tags that only start like a version, e.g. %s"
+            % (r.version_regex, len(partial), partial[0]),
+            "release_tag_re: %s" % regex,
+            "%d fewer releases, ~%.0f%% of tag scanning (%.3fs)"
+            % (len(partial), 100 * frac, frac * self.timings["get_tags"]),
+        )
+
+    def check_commit_graph(self):
+        """Without a commit-graph, every log walk parses every commit."""
+        r = self.runner
+        common_dir = r.git("rev-parse", "--git-common-dir").strip()
+        info = os.path.join(common_dir, "objects", "info")
+        if r.backend.exists(os.path.join(info, "commit-graph")):
+            return
+        if r.backend.exists(os.path.join(info, "commit-graphs")):
+            return
+        self.finding(
+            "no commit-graph file, history walks parse every commit object",
+            "git commit-graph write --reachable; git config fetch.writeCommitGraph true",
+            "history walks are typically 2x faster or more, get_logs took %.3fs"
+            % self.timings["get_logs"],
+        )
+
+    def check_notes_dir(self):
+        """A huge flat notes folder slows --lint and git status."""
+        r = self.runner
+        files = [f for f in r.backend.listdir(r.notes_dir) if f.endswith(".yaml")]
+        self.counts["notes in %s" % r.notes_dir] = len(files)
+        if len(files) <= MAX_FLAT_NOTES:
+            return
+        self.finding(
+            "%d notes in one folder, --lint parses all of them on every run"
+            % len(files),
+            "move notes of old releases into a subfolder (e.g. %s/archive), "
+            "reports still find them" % r.notes_dir,
+            "--lint only parses the %d or so newest notes" % MAX_FLAT_NOTES,
+        )
+
+    def check_cache(self):
+        """Long histories should use --publish-cache."""
+        r = self.runner
+        tags = r.range_tags() or []
+        if len(tags) < MIN_CACHE_TAGS or r.cached:
+            return
+        if r.git("for-each-ref", NOTES_REF).strip():
+            return
+        walk = self.timings["get_logs"] + self.timings["get_notes"]
+        self.finding(
+            "%d releases in range are walked and parsed on every run" % len(tags),
+            "run rnotes --publish-cache after tagging, fetch %s in ci" % NOTES_REF,
+            "only the newest release is walked, ~%.3fs of %.3fs"
+            % (walk / len(tags), walk),
+        )
+
+    def print(self):
+        """Print timings, counts and findings."""
+        print("Phase timings")
+        print("-------------")
+        for name, secs in self.timings.items():
+            print("%-20s %8.3fs" % (name, secs))
+        print()
+        print("Repository")
+        print("----------")
+        for name, num in self.counts.items():
+            print("%-20s %8d" % (name, num))
+        print()
+        print("Findings")
+        print("--------")
+        if not self.findings:
+            print("No problems found.")
+        for problem, suggestion, saving in self.findings:
+            print("-", problem)
+            print("  suggest:", suggestion)
+            print("  saves:", saving)
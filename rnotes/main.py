@@ -32,6 +32,11 @@ def parse_args(args):
         help="Release notes folder (default: releasenotes)",
     )
     parser.add_argument("--debug", help="Debug mode", action="store_true")
+    parser.add_argument(
+        "--reno",
+        help="Read a reno tree: releasenotes/notes, releasenotes/config.yaml, reno sections",
+        action="store_true",
+    )
     parser.add_argument("--yaml", help="Dump yaml", action="store_true")
     parser.add_argument(
         "--lint", help="Lint notes for valid markdown", action="store_true"
@@ -47,9 +52,76 @@ def parse_args(args):
         help="Target branch for merge (default: from ci env or upstream)",
         action="store",
     )
+    parser.add_argument(
+        "--branches",
+        help="With --check: comma separated branches to check in one go, - for stdin",
+    )
     parser.add_argument(
         "--blame", help="Show more commit info in the report", action="store_true"
     )
+    parser.add_argument(
+        "--update",
+        metavar="FILE",
+        help="Add new releases to the top of an existing report file",
+    )
+    parser.add_argument(
+        "--site",
+        metavar="DIR",
+        help="Write one markdown page per release and an index to DIR, only changed pages are rewritten",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Scan history in parallel, split on release tags below any merge (0: one per cpu)",
+    )
+    parser.add_argument(
+        "--stream",
+        help="Write each release as soon as it's read, memory use is one release",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--publish-cache",
+        help="Store finalized releases under refs/notes/rnotes, used by later runs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fingerprint",
+        help="Print a hash of everything the report depends on, for ci caching",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--doctor",
+        help="Time each phase on this repo, and suggest config changes",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--which",
+        metavar="QUERY",
+        help="Print the first release with a note file, or with notes containing some text",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="Save every git call and note read to FILE, for --replay",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="FILE",
+        help="Run from a --record capture instead of the repository",
+    )
+    parser.add_argument(
+        "--since", help="Only notes committed after this date (any git date format)"
+    )
+    parser.add_argument(
+        "--until", help="Only notes committed before this date (any git date format)"
+    )
+    parser.add_argument(
+        "--author", help="Only notes whose commit author matches this regex"
+    )
+    parser.add_argument(
+        "--sections",
+        help="Comma separated list of sections to report on (default: all)",
+    )
     return parser.parse_args(args)
 
 
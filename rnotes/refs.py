@@ -0,0 +1,126 @@
+"""Read git refs directly from the repository, without spawning git.
+
+Only the plain file layout is supported (loose refs + packed-refs, including
+linked worktrees).  Anything else raises UnsupportedRepo, and the caller
+should ask git instead.
+"""
+import os
+import os.path
+import mmap
+import re
+import logging
+
+log = logging.getLogger("rnotes")
+
+SHA_RE = re.compile(rb"^[0-9a-f]{40}(?:[0-9a-f]{24})?$")
+
+TAGS_PREFIX = "refs/tags/"
+
+
+class UnsupportedRepo(Exception):
+    """Repository layout is not one we can read natively."""
+
+
+def find_git_dirs(path="."):
+    """Return (git_dir, common_dir) for the repo containing path.
+
+    For a linked worktree, git_dir is the per-worktree folder (HEAD lives
+    there) and common_dir is the main repository (refs live there).
+    """
+    if os.environ.get("GIT_DIR") or os.environ.get("GIT_COMMON_DIR"):
+        raise UnsupportedRepo("GIT_DIR set in environment")
+
+    cur = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(cur, ".git")
+        if os.path.isdir(dot_git):
+            git_dir = dot_git
+            break
+        if os.path.isfile(dot_git):
+            with open(dot_git, encoding="utf8") as fh:
+                line = fh.read().strip()
+            if not line.startswith("gitdir:"):
+                raise UnsupportedRepo("unexpected .git file: %s" % dot_git)
+            git_dir = os.path.join(cur, line[len("gitdir:") :].strip())
+            break
+        parent = os.path.dirname(cur)
+        if parent == cur:
+            raise UnsupportedRepo("no .git found")
+        cur = parent
+
+    common_dir = git_dir
+    try:
+        with open(os.path.join(git_dir, "commondir"), encoding="utf8") as fh:
+            common_dir = os.path.join(git_dir, fh.read().strip())
+    except FileNotFoundError:
+        pass
+
+    if os.path.exists(os.path.join(common_dir, "reftable")):
+        raise UnsupportedRepo("reftable ref storage")
+
+    return os.path.normpath(git_dir), os.path.normpath(common_dir)
+
+
+def read_packed_refs(common_dir, prefix=""):
+    """Return {refname: (sha, peeled)} from packed-refs, for refs starting with prefix.
+
+    peeled is the commit an annotated tag points to, the sha itself if the
+    file says the ref is not an annotated tag, or None if we can't tell.
+    """
+    refs = {}
+    path = os.path.join(common_dir, "packed-refs")
+    try:
+        fh = open(path, "rb")  # pylint: disable=consider-using-with
+    except FileNotFoundError:
+        return refs
+
+    with fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return refs
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            traits = []
+            if mm[:1] == b"#":
+                traits = mm.readline().split(b":", 1)[-1].split()
+            # "peeled" guarantees it for refs/tags, "fully-peeled" for everything
+            peeled_tags = b"peeled" in traits or b"fully-peeled" in traits
+            fully_peeled = b"fully-peeled" in traits
+            bprefix = prefix.encode("utf8")
+            last = None
+            for line in iter(mm.readline, b""):
+                line = line.rstrip(b"\r\n")
+                if line[:1] == b"^":
+                    if last:
+                        refs[last] = (refs[last][0], line[1:].decode())
+                    continue
+                last = None
+                sha, _, name = line.partition(b" ")
+                if not name.startswith(bprefix) or not SHA_RE.match(sha):
+                    continue
+                last = name.decode("utf8")
+                sha = sha.decode()
+                known = fully_peeled or (peeled_tags and last.startswith(TAGS_PREFIX))
+                refs[last] = (sha, sha if known else None)
+    return refs
+
+
+def read_loose_refs(common_dir, prefix):
+    """Return {refname: (sha, None)} for loose refs under prefix."""
+    refs = {}
+    top = os.path.join(common_dir, *prefix.rstrip("/").split("/"))
+    for root, _dirs, files in os.walk(top):
+        for file in files:
+            path = os.path.join(root, file)
+            with open(path, "rb") as fh:
+                sha = fh.read().strip()
+            if not SHA_RE.match(sha):
+                raise UnsupportedRepo("unexpected loose ref: %s" % path)
+            name = os.path.relpath(path, common_dir).replace(os.sep, "/")
+            refs[name] = (sha.decode(), None)
+    return refs
+
+
+def read_tags(common_dir):
+    """Return {tag: (sha, peeled)} for all tags.  Loose refs win over packed ones."""
+    refs = read_packed_refs(common_dir, TAGS_PREFIX)
+    refs.update(read_loose_refs(common_dir, TAGS_PREFIX))
+    return {name[len(TAGS_PREFIX) :]: val for name, val in refs.items()}
@@ -0,0 +1,57 @@
+"""rnotes --reno: read a reno style releasenotes tree, config and sections."""
+import logging
+
+import yaml
+
+log = logging.getLogger("rnotes")
+
+RENO_DIR = "releasenotes"
+
+# reno looks in the notes folder first, then the repo root
+RENO_CONFIG_PATHS = ("./releasenotes/config.yaml", "./reno.yaml")
+
+# reno's defaults, for anything the config leaves out
+RENO_DEFAULTS = {
+    "notesdir": "notes",
+    "prelude_section_name": "prelude",
+    "earliest_version": None,
+    # reno compiles this with re.VERBOSE
+    "release_tag_re": r"((?:v?[\d.ab]|rc)+)",
+    "sections": [
+        ["features", "New Features"],
+        ["issues", "Known Issues"],
+        ["upgrade", "Upgrade Notes"],
+        ["deprecations", "Deprecation Notes"],
+        ["critical", "Critical Issues"],
+        ["security", "Security Issues"],
+        ["fixes", "Bug Fixes"],
+        ["other", "Other Notes"],
+    ],
+    "template": "---\n"
+    "prelude: >\n"
+    "    Replace this text with content to appear at the\n"
+    "    top of the section for this release.\n"
+    "features:\n"
+    "  - List new features here, or remove this section.\n",
+}
+
+
+def reno_config(backend):
+    """Return (config path, rnotes config) from reno's config file and defaults."""
+    path = RENO_CONFIG_PATHS[0]
+    reno = {}
+    for cand in RENO_CONFIG_PATHS:
+        try:
+            reno = yaml.safe_load(backend.read_file(cand)) or {}
+            path = cand
+            break
+        except FileNotFoundError:
+            continue
+    log.debug("reno config: %s", path)
+
+    cfg = dict(RENO_DEFAULTS, **reno)
+    notes_dir = RENO_DIR + "/" + cfg.pop("notesdir").strip("/")
+    # reno's own option names are the same as ours, except the folder
+    cfg["notes_dir"] = notes_dir
+    cfg["release_tag_re"] = "(?x)" + cfg["release_tag_re"]
+    return path, cfg
@@ -1,5 +1,6 @@
 """Release notes runner class"""
 import os
+import hashlib
 import os.path
 import re
 import shutil
@@ -8,10 +9,21 @@ import logging
 import sys
 import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import yaml.representer
 
+from rnotes.refs import UnsupportedRepo, TAGS_PREFIX
+from rnotes.backend import LocalBackend, RecordingBackend, ReplayBackend
+from rnotes.site import Site
+from rnotes.update import Update
+from rnotes.cache import NotesCache
+from rnotes.doctor import Doctor
+from rnotes.stream import Stream
+from rnotes.which import Which
+from rnotes.reno import reno_config
+
 yaml.add_representer(defaultdict, yaml.representer.Representer.represent_dict)
 
 
@@ -49,22 +61,45 @@ log = logging.getLogger("rnotes")
 
 CONFIG_PATH = "./rnotes.yaml"
 
+# yaml that can hide a key from a line based check: flow mappings, explicit
+# keys, anchors and aliases, tags, escapes
+YAML_HIDDEN_KEYS = re.compile(r"[{?&*!\\]")
+
+
+def version_key(decoration):
+    """Sort key for the first tag in a decoration, numbers compare as numbers."""
+    tag = re.search(r"\btag: ([^\s,]+)", decoration)
+    tag = tag[1] if tag else ""
+    return [
+        int(part) if i % 2 else part for i, part in enumerate(re.split(r"(\d+)", tag))
+    ]
+
 
 def normalize(git_dir):
     """Normalize to forward slash, strip off ./ from the front."""
     return git_dir.replace("\\", "/").replace("./", "")
 
 
-class Runner:  # pylint: disable=too-many-instance-attributes
+class Runner:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
     """Process rnotes command line args."""
 
     def __init__(self, args):
         self.args = args
-        try:
-            with open(CONFIG_PATH, encoding="utf8") as fh:
-                self.cfg = yaml.safe_load(fh)
-        except FileNotFoundError:
-            self.cfg = DEFAULT_CONFIG.copy()
+        if args.replay:
+            self.backend = ReplayBackend(args.replay)
+        elif args.record:
+            self.backend = RecordingBackend(args.record)
+        else:
+            self.backend = LocalBackend()
+
+        self.config_path = CONFIG_PATH
+        if args.reno:
+            self.config_path, self.cfg = reno_config(self.backend)
+        else:
+            try:
+                self.cfg = yaml.safe_load(self.backend.read_file(CONFIG_PATH))
+            except FileNotFoundError:
+                self.cfg = DEFAULT_CONFIG.copy()
 
         self.prelude_name = self.cfg.get("prelude_section_name", "release_summary")
         self.earliest = self.cfg.get("earliest_version")
@@ -73,10 +108,16 @@ class Runner:  # pylint: disable=too-many-instance-attributes
             or self.cfg.get("release_tag_re")
             or DEFAULT_CONFIG.get("release_tag_re")
         )
+        self.tag_re = re.compile(self.version_regex)
         self.tags = []
+        self.tag_info = {}
         self.logs = []
         self.notes = {}
         self.report = ""
+        self.update = None
+        self.site = None
+        self.cache = NotesCache(self)
+        self.cached = {}
         self.ver_start = self.args.previous
         self.ver_end = self.args.version or "HEAD"
         notes_dir = self.args.notes_dir or self.cfg.get(
@@ -85,26 +126,117 @@ class Runner:  # pylint: disable=too-many-instance-attributes
         self.notes_dir = normalize(notes_dir)
 
         log.debug("notes_dir: %s", self.notes_dir)
-        if not os.path.exists(self.notes_dir):
+        if not self.backend.exists(self.notes_dir):
             raise FileNotFoundError("expected folder: %s" % self.notes_dir)
 
         self.sections = dict(self.cfg.get("sections", {}))
         self.valid_sections = {self.prelude_name, *self.sections.keys()}
 
-        self.__git = shutil.which("git")
-
-    def git(self, *args):
+        self.since = self.args.since
+        self.until = self.args.until
+        self.author = self.args.author
+        self.since_ts = None
+        self.until_ts = None
+        self.wanted_sections = None
+        self.wanted_re = None
+        if self.args.sections:
+            self.wanted_sections = {
+                sec.strip() for sec in self.args.sections.split(",") if sec.strip()
+            }
+            self.wanted_re = re.compile(
+                r"^\s*[\"']?(?:%s)[\"']?\s*:"
+                % "|".join(re.escape(sec) for sec in sorted(self.wanted_sections)),
+                re.M,
+            )
+
+    def git(self, *args, stdin=None):
         """Shell git with args."""
         log.debug("+ git %s", " ".join(args))
-        cmd = [self.__git] + list(args)
-        ret = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, encoding="utf8")
-        return ret.stdout
+        return self.backend.git(*args, stdin=stdin)
+
+    def git_lines(self, *args):
+        """Shell git with args, yield its output a line at a time."""
+        log.debug("+ git %s", " ".join(args))
+        return self.backend.git_lines(*args)
 
     def get_tags(self):
-        """Get release tags, reverse sorted."""
+        """Get release tags, reverse sorted.
+
+        Tag refs are read from the repository files, but one git call is still
+        needed: git log --no-walk gives the candidates' commit times and
+        decorations, for sorting and for spotting HEAD.
+        """
         self.tags = []
 
-        for tag in self.git("log", self.ver_end, "--tags", "--pretty=%D").split("\n"):
+        try:
+            refs = self.backend.read_tags()
+        except UnsupportedRepo as e:
+            log.debug("reading tags with git: %s", e)
+            self._parse_tags(
+                self.git("log", self.ver_end, "--tags", "--pretty=%D").split("\n")
+            )
+        else:
+            # only ask git to sort the candidates, no need to walk history.
+            # commit ids where packed-refs has them peeled, so git doesn't
+            # look the refs up or open the tag objects again
+            cands = list(
+                dict.fromkeys(
+                    peeled or sha
+                    for tag, (sha, peeled) in refs.items()
+                    if self.tag_re.match(tag) or tag == self.earliest
+                )
+            )
+            if cands:
+                out = self.git(
+                    "log",
+                    "--no-walk",
+                    "--stdin",
+                    "--pretty=%ct^%D",
+                    stdin="\n".join(cands),
+                )
+                ents = [ent.split("^", 1) for ent in out.split("\n") if "^" in ent]
+                # newest first, same commit time: highest version first
+                ents.sort(key=lambda ent: (int(ent[0]), version_key(ent[1])))
+                self._parse_tags(deco for _, deco in reversed(ents))
+
+        self.tags = list(reversed(self.tags))
+        self.get_tag_info()
+
+        log.debug("tags: %s", self.tags)
+
+    def get_tag_info(self):
+        """Fill self.tag_info with {tag: time, commit, message} for release tags.
+
+        One for-each-ref call covers every tag, instead of a git log per tag.
+        """
+        self.tag_info = {}
+        if not self.tags:
+            return
+        out = self.git(
+            "for-each-ref",
+            "--format=%(refname:strip=2)%1f%(objecttype)%1f%(creatordate:unix)"
+            "%1f%(objectname)%1f%(*objectname)"
+            # subject and body leave out the signature of a signed tag
+            "%1f%(contents:subject)%1f%(contents:body)%1e",
+            TAGS_PREFIX,
+        )
+        tags = set(self.tags)
+        for ent in out.split("\x1e"):
+            info = ent.lstrip("\n").split("\x1f")
+            if len(info) < 7 or info[0] not in tags:
+                continue
+            tag, otype, ct, sha, peeled, subject, body = info
+            annotated = otype == "tag"
+            message = (subject + "\n\n" + body).strip() if annotated else ""
+            self.tag_info[tag] = {
+                # tagger date, or the commit date of a lightweight tag
+                "time": int(ct),
+                "commit": peeled if annotated else sha,
+                "message": message,
+            }
+
+    def _parse_tags(self, decorations):
+        for tag in decorations:
             tag = tag.strip()
             if not tag:
                 continue
@@ -113,17 +245,13 @@ class Runner:  # pylint: disable=too-many-instance-attributes
             if not tag:
                 continue
             tag = tag[1]
-            if re.match(self.version_regex, tag):
+            if self.tag_re.match(tag):
                 self.tags.append(tag)
                 if head:
                     self.ver_end = tag
             if tag == self.earliest:
                 break
 
-        self.tags = list(reversed(self.tags))
-
-        log.debug("tags: %s", self.tags)
-
     def get_start_from_end(self):
         """If start not specified, assume previous release."""
         if not self.ver_start:
@@ -138,69 +266,275 @@ class Runner:  # pylint: disable=too-many-instance-attributes
 
         log.debug("prev: %s, cur: %s", self.ver_start, self.ver_end)
 
+    def get_filters(self):
+        """Validate --sections, and resolve --since/--until to timestamps."""
+        if self.wanted_sections:
+            for sec in self.wanted_sections:
+                assert sec in self.valid_sections, "%s is not a valid section" % sec
+
+        if not (self.since or self.until):
+            return
+
+        # let git parse the dates, so we accept the same formats as git log
+        dates = []
+        if self.since:
+            dates.append("--since=" + self.since)
+        if self.until:
+            dates.append("--until=" + self.until)
+        for ent in self.git("rev-parse", *dates).split("\n"):
+            ent = ent.strip()
+            if ent.startswith("--max-age="):
+                self.since_ts = int(ent[len("--max-age=") :])
+            if ent.startswith("--min-age="):
+                self.until_ts = int(ent[len("--min-age=") :])
+
+        log.debug("since: %s, until: %s", self.since_ts, self.until_ts)
+
+    def is_filtered(self):
+        """True if any of the report filters are used."""
+        return bool(self.since or self.until or self.author or self.wanted_sections)
+
+    def wanted(self, ct, ident):
+        """True if a note added at time ct, by ident ("name <email>") passes the filters."""
+        if self.since_ts is not None and int(ct) < self.since_ts:
+            return False
+        if self.until_ts is not None and int(ct) > self.until_ts:
+            return False
+        if self.author and not re.search(self.author, ident):
+            return False
+        return True
+
+    def get_cached(self):
+        """Use releases published to the notes ref, only the rest gets walked."""
+        if self.args.lint or self.is_filtered():
+            return
+        tags = self.range_tags()
+        if not tags:
+            return
+        self.cached = self.cache.load(tags)
+        if self.cached:
+            self.ver_start = list(self.cached)[-1]
+            log.debug("cached up to: %s", self.ver_start)
+
     def get_logs(self):
         """Get a list of logs with tag, hash and ct."""
-        cur_tag = self.ver_end
-        ct = 0
-        cname = ""
-        hsh = ""
+        if self.args.jobs is not None:
+            shards = self.get_shards()
+            if shards:
+                self.get_logs_parallel(shards)
+                return
         if self.ver_start == "TAIL" or not self.ver_start:
             vers = self.ver_end
         else:
             vers = self.ver_start + ".." + self.ver_end
-        for ent in self.git(
-            "log", vers, "--name-only", "--format=%D^%ct^%cn^%h", "--diff-filter=A"
-        ).split("\n"):
+        logs, _ = self.scan_logs(vers, self.ver_end)
+        self.logs += logs
+
+    def scan_logs(self, vers, cur_tag):
+        """Run git log on vers, return (logs, last tag seen).
+
+        Entries before the first tag decoration are assigned cur_tag.
+        """
+        tags = [cur_tag]
+        lines = self.git(*self.log_cmd(vers)).split("\n")
+        logs = list(self.iter_logs(lines, cur_tag, tags.append))
+        return logs, tags[-1]
+
+    def log_cmd(self, vers):
+        """Git args for a log of notes added in vers."""
+        cmd = [
+            "log",
+            vers,
+            "--name-only",
+            "--format=%D^%ct^%cn^%h^%an <%ae>",
+            "--diff-filter=A",
+        ]
+        if self.since:
+            # stops the walk early, older commits are never visited
+            cmd.append("--since=" + self.since)
+        # --until and --author are not passed to git: they would hide the
+        # tag decorations that mark release boundaries, so they are checked
+        # here instead, before any note is read
+        return cmd
+
+    def iter_logs(self, lines, cur_tag, on_tag=None):
+        """Yield (tag, ct, cname, hsh, file) for each wanted note in log_cmd output.
+
+        on_tag is called with each tag decoration, as the walk crosses it.
+        """
+        ct = 0
+        cname = ""
+        hsh = ""
+        ident = ""
+        for ent in lines:
             ent = ent.strip()
             info = ent.split("^")
             if len(info) > 1:
-                tag, ct, cname, hsh = info
+                tag, ct, cname, hsh, ident = info
                 tag = re.search(r"\btag: ([\S,]+)", tag)
                 if tag:
                     cur_tag = tag[1]
-            if ent.startswith(self.notes_dir):
-                self.logs.append((cur_tag, ct, cname, hsh, ent))
+                    if on_tag:
+                        on_tag(cur_tag)
+            if ent.startswith(self.notes_dir) and self.wanted(ct, ident):
+                yield (cur_tag, ct, cname, hsh, ent)
+
+    def range_tags(self):
+        """Release tags in the log range, oldest first.  None if start isn't a tag."""
+        if self.ver_start == "TAIL" or not self.ver_start:
+            lo = 0
+        elif self.ver_start in self.tags:
+            lo = self.tags.index(self.ver_start) + 1
+        else:
+            return None
+
+        if self.ver_end in self.tags:
+            hi = self.tags.index(self.ver_end) + 1
+        else:
+            hi = len(self.tags)
+
+        return self.tags[lo:hi]
+
+    def get_shards(self):
+        """Split the log range on release tags into git revision ranges, newest first.
+
+        Returns None if the range can't be split, or there's no point.
+        """
+        tags = self.range_tags()
+        if tags is None:
+            return None
+        first = None if self.ver_start == "TAIL" else self.ver_start
+
+        # a release tagged on another branch is never visited by git log
+        merged = set(self.git("tag", "--merged", self.ver_end).split())
+        inner = [tag for tag in tags if tag != self.ver_end and tag in merged]
+        bounds = [first] + inner + [self.ver_end]
+        num = len(bounds) - 1
+        if num < 2:
+            return None
+
+        # with merges, git log's date order decides which release a note
+        # lands in: only the linear history below them can be split
+        vers = first + ".." + self.ver_end if first else self.ver_end
+        serial = []
+        if self.git("rev-list", "--merges", "-n", "1", vers).strip():
+            split = self.get_split(first, inner)
+            serial = [split + ".." + self.ver_end if split else vers]
+            log.info("--jobs: merges in %s, scanning it serially", serial[0])
+            if split is None:
+                return None
+            bounds = bounds[: bounds.index(split) + 1]
+            num = len(bounds) - 1
+
+        # a few shards per worker, so one big release doesn't hold up the rest
+        groups = min(num, (self.args.jobs or os.cpu_count() or 1) * 4)
+        shards = []
+        for i in range(groups):
+            prev = bounds[round(i * num / groups)]
+            tag = bounds[round((i + 1) * num / groups)]
+            shards.append(prev + ".." + tag if prev else tag)
+
+        shards = serial + list(reversed(shards))
+        log.debug("shards: %s", shards)
+        return shards
+
+    def get_split(self, first, inner):
+        """Newest of the inner tags with linear history below it, or None.
+
+        Only if git log walks everything above it before the tag itself, so
+        one log above it and shards below it add up to the same walk.
+        """
+
+        def linear(tag):
+            vers = first + ".." + tag if first else tag
+            return not self.git("rev-list", "--merges", "-n", "1", vers).strip()
+
+        # tags are oldest first, and usually once one has a merge below it
+        # the rest do too; lo - 1 is always a linear one
+        lo, hi = 0, len(inner)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            lo, hi = (mid + 1, hi) if linear(inner[mid]) else (lo, mid)
+        if not lo:
+            return None
+        split = inner[lo - 1]
+
+        # reached only through the tag, and all newer than it: date order
+        # can't interleave the two sides
+        sha = self.git("rev-parse", split + "^{commit}").strip()
+        above = self.git(
+            "log", "--boundary", "--format=%m %H %ct", split + ".." + self.ver_end
+        ).split("\n")
+        above = [line.split() for line in above if line]
+        edge = {hsh: int(ct) for mark, hsh, ct in above if mark == "-"}
+        if list(edge) != [sha]:
+            return None
+        if any(int(ct) <= edge[sha] for mark, _, ct in above if mark != "-"):
+            return None
+        return split
+
+    def get_logs_parallel(self, shards):
+        """Scan shards concurrently, merge them as if it was one git log."""
+        jobs = self.args.jobs or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(lambda vers: self.scan_logs(vers, None), shards))
+
+        # a shard doesn't know its tag until it sees a decoration, which may
+        # be never, so carry the tag over from the newer shard like git log would
+        cur_tag = self.ver_end
+        for logs, last in results:
+            for tag, ct, cname, hsh, file in logs:
+                self.logs.append((tag or cur_tag, ct, cname, hsh, file))
+            cur_tag = last or cur_tag
 
     def load_note(self, tag, file, ct, cname, hsh, notes):
         """Load specified note into notes list."""
         try:
             log.debug("load note: %s, %s", tag, file)
-            with open(file, encoding="utf8") as f:
-                note = yaml.safe_load(f)
-                for k, v in note.items():
-                    assert k in self.valid_sections, "%s: %s is not a valid section" % (
-                        file,
-                        k,
-                    )
-                    if type(v) is str:
-                        v = [v]
-                    assert (
-                        type(v) is list
-                    ), "%s: '%s' : list of entries or single string" % (file, k)
-                    for line in v:
-                        assert (
-                            type(line) is str
-                        ), "%s: '%s' : must be a simple string" % (file, line)
-                        line = {
-                            "time": int(ct),
-                            "name": cname,
-                            "hash": hsh,
-                            "note": line,
-                        }
-                        notes[tag][k].append(line)
+            text = self.backend.read_file(file)
+            info = {"time": int(ct), "name": cname, "hash": hsh}
+            self.parse_note(tag, file, text, info, notes)
         except FileNotFoundError:
             log.debug("ignoring missing file %s", file)
         except Exception as e:
             print("Error reading file %s: %s" % (file, repr(e)))
             raise
 
+    def parse_note(self, tag, file, text, info, notes):
+        """Parse note text into notes list, info is the commit info for each entry."""
+        skip = self.wanted_re and not YAML_HIDDEN_KEYS.search(text)
+        if skip and not self.args.lint and not self.wanted_re.search(text):
+            log.debug("no wanted sections: %s", file)
+            return
+        note = yaml.safe_load(text)
+        for k, v in note.items():
+            assert k in self.valid_sections, "%s: %s is not a valid section" % (
+                file,
+                k,
+            )
+            if self.wanted_sections and k not in self.wanted_sections:
+                continue
+            if type(v) is str:
+                v = [v]
+            assert type(v) is list, "%s: '%s' : list of entries or single string" % (
+                file,
+                k,
+            )
+            for line in v:
+                assert type(line) is str, "%s: '%s' : must be a simple string" % (
+                    file,
+                    line,
+                )
+                notes[tag][k].append(dict(info, note=line))
+
     def get_notes(self):
         """Fill self.notes with a structured list of notes."""
-        seen = {}
+        # a cached release owns its files, even if a merge brings them into
+        # the walked part of the log again
+        seen = {file: True for rec in self.cached.values() for file in rec["files"]}
         notes = defaultdict(lambda: defaultdict(lambda: []))
         for tag, ct, cname, hsh, file in self.logs:
-            if seen.get(file):  # pragma: no cover
-                # defensive, can happen with weird logs, hard to set up
+            if seen.get(file):
                 continue
             seen[file] = True
             try:
@@ -208,76 +542,106 @@ class Runner:  # pylint: disable=too-many-instance-attributes
             except FileNotFoundError:
                 pass
 
+        # older than anything in the log, newest first
+        for tag, rec in reversed(list(self.cached.items())):
+            for sec, ents in rec["notes"].items():
+                notes[tag][sec] += ents
+
+        self.load_worktree(seen, notes)
+        self.notes = notes
+
+    def load_worktree(self, seen, notes):
+        """Load staged and changed notes (every note with --lint) not in seen."""
         cname = self.git("config", "user.name").strip()
+        ident = ""
+        if self.author:
+            # strip the date off: "name <email> 1663596213 -0400"
+            ident = self.git("var", "GIT_AUTHOR_IDENT").strip().rsplit(" ", 2)[0]
 
         for file in self.git("diff", "--name-only", "--cached").split("\n"):
             path = normalize(file.strip())
-            self._load_uncommitted(seen, notes, path, cname)
+            self._load_uncommitted(seen, notes, path, cname, ident)
 
         for porc in self.git("status", "--porcelain").split("\n"):
             path = normalize(porc[3:].strip())
-            self._load_uncommitted(seen, notes, path, cname)
+            self._load_uncommitted(seen, notes, path, cname, ident)
 
         if self.args.lint:
             # every file, not just diffs
-            for file in os.listdir(self.notes_dir):
+            for file in self.backend.listdir(self.notes_dir):
                 path = normalize(os.path.join(self.notes_dir, file))
                 self._load_uncommitted(seen, notes, path, cname)
 
-        self.notes = notes
-
-    def _load_uncommitted(self, seen, notes, path, cname):
+    def _load_uncommitted(self, seen, notes, path, cname, ident=None):
         if seen.get(path):
             return
-        if not os.path.isfile(path):
+        if not self.backend.isfile(path):
             return
         if not path.endswith(".yaml"):
             return
         if not path.startswith(self.notes_dir):
             return
+        mtime = self.backend.mtime(path)
+        if ident is not None and not self.wanted(mtime, ident):
+            return
         seen[path] = True
-        self.load_note("Uncommitted", path, os.stat(path).st_mtime, cname, None, notes)
+        self.load_note("Uncommitted", path, mtime, cname, None, notes)
 
-    def get_report(self):
-        """Turn self.notes into a markdown report."""
+    def get_report(self, fh=None):
+        """Turn self.notes into a markdown report, written to fh (default: stdout)."""
         num = 0
         for tag, sections in self.notes.items():
-            if tag == "HEAD":
-                tag = "Current Branch"
             if num > 0:
-                print("")
+                print("", file=fh)
             num += 1
-            print(tag)
-            print("=" * len(tag))
-
-            ents = sections.get(self.prelude_name, {})
+            self.render_release(tag, sections, fh)
+
+    def render_release(self, tag, sections, fh=None):
+        """Write the markdown section for a single release to fh."""
+        info = self.tag_info.get(tag)
+        if tag == "HEAD":
+            tag = "Current Branch"
+        if info:
+            tag += time.strftime(" (%Y-%m-%d)", time.localtime(info["time"]))
+        print(tag, file=fh)
+        print("=" * len(tag), file=fh)
+
+        ents = sections.get(self.prelude_name, {})
+        for ent in sorted(ents, key=lambda ent: ent["time"], reverse=True):
+            note = ent["note"].strip()
+            print(note, "\n", file=fh)
+
+        for sec, title in self.sections.items():
+            ents = sections.get(sec, {})
+            if not ents:
+                continue
+            print(file=fh)
+            print(title, file=fh)
+            print("-" * len(title), file=fh)
             for ent in sorted(ents, key=lambda ent: ent["time"], reverse=True):
-                note = ent["note"].strip()
-                print(note, "\n")
+                note = ent["note"]
+                if self.args.blame:
+                    epoch = ent["time"]
+                    name = ent["name"]
+                    hsh = ent["hash"]
+                    hsh = "`" + hsh + "`" if hsh else ""
+                    print(
+                        "-",
+                        note,
+                        hsh,
+                        "(" + name + ")",
+                        time.strftime("%y-%m-%d", time.localtime(epoch)),
+                        file=fh,
+                    )
+                else:
+                    print("-", note, file=fh)
 
-            for sec, title in self.sections.items():
-                ents = sections.get(sec, {})
-                if not ents:
-                    continue
-                print()
-                print(title)
-                print("-" * len(title))
-                for ent in sorted(ents, key=lambda ent: ent["time"], reverse=True):
-                    note = ent["note"]
-                    if self.args.blame:
-                        epoch = ent["time"]
-                        name = ent["name"]
-                        hsh = ent["hash"]
-                        hsh = "`" + hsh + "`" if hsh else ""
-                        print(
-                            "-",
-                            note,
-                            hsh,
-                            "(" + name + ")",
-                            time.strftime("%y-%m-%d", time.localtime(epoch)),
-                        )
-                    else:
-                        print("-", note)
+    def release_yaml(self, tag, sections):
+        """Sections of a release for --yaml, with its tag info under _release."""
+        info = self.tag_info.get(tag)
+        if not info:
+            return sections
+        return {"_release": info, **sections}
 
     def get_branch(self):
         """Get current branch name."""
@@ -332,6 +696,12 @@ class Runner:  # pylint: disable=too-many-instance-attributes
 
     def run(self):
         """Run the program, with current args."""
+        try:
+            self._run()
+        finally:
+            self.backend.close()
+
+    def _run(self):
         orig = None
         if self.args.create:
             self.create_new()
@@ -341,29 +711,141 @@ class Runner:  # pylint: disable=too-many-instance-attributes
             self.branch_check()
             return
 
+        if self.args.fingerprint:
+            self.get_filters()
+            self.get_tags()
+            self.get_start_from_end()
+            print(self.get_fingerprint())
+            return
+
+        if self.args.doctor:
+            Doctor(self).run()
+            return
+
+        if self.args.which:
+            Which(self, self.args.which).run()
+            return
+
         if self.ver_end != "HEAD":
             orig = self.get_branch()
             self.switch_branch(self.ver_end)
         try:
+            self.get_filters()
             self.get_tags()
+            if self.args.update:
+                self.update = Update(self, self.args.update)
+                self.ver_start = self.update.get_start(self.ver_start)
+            if self.args.site:
+                self.site = Site(self, self.args.site)
+                self.ver_start = self.ver_start or self.site.get_start()
+            if self.args.publish_cache:
+                assert not self.is_filtered(), "can't publish a filtered report"
+                self.ver_start = self.ver_start or "TAIL"
             self.get_start_from_end()
-            self.get_logs()
+            self.get_cached()
+            # the log walk only needs refs, notes are read from the worktree
             if orig:
                 self.switch_branch(orig)
                 orig = None
-            self.get_notes()
-            if self.args.lint:
+            if self.args.stream:
+                self.check_stream()
+                Stream(self).run()
                 return
-            if self.args.yaml:
-                print(yaml.dump(self.notes))
-                return
-            self.get_report()
-
-            print(self.report)
+            self.get_logs()
+            self.get_notes()
+            self.write_output()
         finally:
             if orig:
                 self.switch_branch(orig)
 
+    def check_stream(self):
+        """--stream writes a plain report as it goes, nothing else can do that."""
+        for name in ("lint", "update", "site", "publish_cache"):
+            assert not getattr(self.args, name), "--%s can't be used with --stream" % (
+                name.replace("_", "-")
+            )
+        assert self.args.jobs is None, "--jobs can't be used with --stream"
+
+    def write_output(self):
+        """Output self.notes in the format asked for."""
+        if self.args.lint:
+            pass
+        elif self.update:
+            self.update.write()
+        elif self.args.publish_cache:
+            self.cache.publish(self.range_tags() or [])
+        elif self.site:
+            self.site.write()
+        elif self.args.yaml:
+            print(
+                yaml.dump(
+                    {
+                        tag: self.release_yaml(tag, sections)
+                        for tag, sections in self.notes.items()
+                    }
+                )
+            )
+        else:
+            self.get_report()
+            print(self.report)
+
+    def get_tag_refs(self):
+        """Return {tag: object id} for every tag in the repo."""
+        try:
+            return {tag: sha for tag, (sha, _) in self.backend.read_tags().items()}
+        except UnsupportedRepo:
+            refs = {}
+            out = self.git(
+                "for-each-ref", "--format=%(objectname) %(refname:strip=2)", TAGS_PREFIX
+            )
+            for ent in out.split("\n"):
+                if ent:
+                    sha, tag = ent.split(" ", 1)
+                    refs[tag] = sha
+            return refs
+
+    def get_fingerprint(self):
+        """Hash of everything the report depends on, without walking the log."""
+        parts = []
+        for name in ("yaml", "blame", "lint", "sections", "author", "reno"):
+            parts.append("arg %s %s" % (name, getattr(self.args, name)))
+        parts.append("dates %s %s" % (self.since_ts, self.until_ts))
+        parts.append("notes_dir %s" % self.notes_dir)
+        parts.append("tag_re %s" % self.version_regex)
+
+        try:
+            config = self.backend.read_file(self.config_path).encode("utf8")
+            parts.append("config " + hashlib.sha256(config).hexdigest())
+        except FileNotFoundError:
+            parts.append("config none")
+
+        revs = [rev for rev in (self.ver_start, self.ver_end) if rev and rev != "TAIL"]
+        shas = self.git("rev-parse", *[rev + "^{commit}" for rev in revs]).split()
+        parts.append("range %s %s" % (self.ver_start, self.ver_end))
+        parts += ["rev " + sha for sha in shas]
+
+        refs = self.get_tag_refs()
+        for tag in sorted(refs):
+            if self.tag_re.match(tag) or tag == self.earliest:
+                parts.append("tag %s %s" % (tag, refs[tag]))
+
+        # committed and staged notes: blob ids straight from the index
+        parts += self.git("ls-files", "-s", "--", self.notes_dir).split("\n")
+
+        # anything not in the index yet
+        status = self.git(
+            "status", "--porcelain", "--untracked-files=all", "--", self.notes_dir
+        )
+        for porc in sorted(status.split("\n")):
+            path = normalize(porc[3:].strip())
+            parts.append("status " + porc)
+            if self.backend.isfile(path):
+                text = self.backend.read_file(path).encode("utf8")
+                parts.append("file " + hashlib.sha256(text).hexdigest())
+
+        log.debug("fingerprint: %s", parts)
+        return hashlib.sha256("\n".join(parts).encode("utf8")).hexdigest()
+
     def message(self, msgid):
         """Get a message based on msgid, uses DEFAULT_CONFIG if not set."""
         msg = self.cfg.get("messages", {}).get(msgid, None)
@@ -378,8 +860,8 @@ class Runner:  # pylint: disable=too-many-instance-attributes
                 return True
         return False
 
-    def branch_check(self):
-        """Check current branch for new notes."""
+    def get_target(self):
+        """Get the merge target branch for --check."""
         # target for diff, in order of precedence
 
         target = self.args.target
@@ -402,6 +884,15 @@ class Runner:  # pylint: disable=too-many-instance-attributes
                     target = ent
 
         assert target, self.message(Msg.NEED_TARGET)
+        return target
+
+    def branch_check(self):
+        """Check current branch for new notes."""
+        if self.args.branches:
+            self.branches_check()
+            return
+
+        target = self.get_target()
 
         try:
             diff_base = self.git("merge-base", "HEAD", target).strip()
@@ -434,3 +925,74 @@ class Runner:  # pylint: disable=too-many-instance-attributes
                 return
 
         assert False, self.message(Msg.NEED_NOTE)
+
+    def branches_check(self):
+        """Check many branches against the same target, print a pass/fail table."""
+        branches = self.args.branches
+        if branches == "-":
+            branches = sys.stdin.read()
+        branches = [br for br in re.split(r"[,\s]+", branches) if br]
+
+        # resolved once, shared by every branch
+        target = self.get_target()
+        target_sha = self.git("rev-parse", "--verify", target + "^{commit}").strip()
+        print("Check merge target:", target + ",", len(branches), "branches")
+
+        jobs = self.args.jobs or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            results = list(
+                pool.map(lambda br: self.check_one(br, target_sha), branches)
+            )
+
+        width = max(len(br) for br in ["branch", *branches])
+        rows = [("branch", "result", "exit", "detail")]
+        for br, (code, detail) in zip(branches, results):
+            rows.append((br, "fail" if code else "pass", str(code), detail))
+        for row in rows:
+            print(row[0].ljust(width), row[1].ljust(6), row[2].ljust(4), row[3])
+
+        failed = [br for br, (code, _) in zip(branches, results) if code]
+        assert not failed, "%d of %d branches failed the check: %s" % (
+            len(failed),
+            len(branches),
+            ", ".join(failed),
+        )
+
+    def check_one(self, branch, target):
+        """Check a single branch (not checked out) for new notes, returns (exit code, detail)."""
+        try:
+            try:
+                diff_base = self.git("merge-base", branch, target).strip()
+            except subprocess.CalledProcessError:
+                diff_base = target
+
+            need_notes = False
+            found = None
+            # one diff gives us both the changed files and the added ones
+            diff = self.git("diff", "--name-status", "--no-renames", diff_base, branch)
+            for ent in diff.split("\n"):
+                status, _, ent = ent.partition("\t")
+                ent = ent.strip()
+                if not ent or self.not_important(ent):
+                    continue
+                if ent.startswith(self.notes_dir):
+                    if status != "D":
+                        self.lint_blob(branch, ent)
+                    if status == "A":
+                        found = found or ent
+                    continue
+                need_notes = True
+
+            if not need_notes:
+                return 0, "no changes that need a note"
+            assert found, self.message(Msg.NEED_NOTE)
+            return 0, "found new note: " + found
+        except (subprocess.CalledProcessError, AssertionError) as e:
+            return 1, str(e)
+
+    def lint_blob(self, branch, path):
+        """Lint a note file as it is on branch, without checking it out."""
+        notes = defaultdict(lambda: defaultdict(lambda: []))
+        text = self.git("show", branch + ":" + path)
+        if path.endswith(".yaml"):
+            self.parse_note(branch, path, text, {}, notes)
@@ -0,0 +1,136 @@
+"""Static changelog site: one markdown page per release, plus an index."""
+import io
+import os
+import os.path
+import re
+import hashlib
+import logging
+
+import yaml
+
+log = logging.getLogger("rnotes")
+
+MANIFEST = ".rnotes-manifest.yaml"
+INDEX = "index.md"
+
+# releases that can still change, everything else is final once it has a page
+TRANSIENT = ("HEAD", "Uncommitted")
+
+
+def page_name(tag):
+    """File name for a release page."""
+    if tag == "HEAD":
+        return "current-branch.md"
+    if tag == "Uncommitted":
+        return "uncommitted.md"
+    return re.sub(r"[^\w.-]+", "_", tag) + ".md"
+
+
+def content_hash(text):
+    """Hash of page contents, stored in the manifest."""
+    return hashlib.sha256(text.encode("utf8")).hexdigest()
+
+
+class Site:
+    """Incrementally maintained folder of release pages."""
+
+    def __init__(self, runner, path):
+        self.runner = runner
+        self.path = path
+        self.pages = []
+        try:
+            with open(os.path.join(path, MANIFEST), encoding="utf8") as fh:
+                self.pages = (yaml.safe_load(fh) or {}).get("pages", [])
+        except FileNotFoundError:
+            pass
+
+    def get_start(self):
+        """Newest finalized release that already has a page, or TAIL if none.
+
+        Finalized pages are frozen: a note edited after its release was
+        written doesn't change the page, run with --previous TAIL (or an older
+        tag) to rebuild from there.  A page that's missing or was changed on
+        disk is rebuilt, with everything newer than it.
+        """
+        tags = self.runner.tags
+        pages = [page for page in self.pages if page["tag"] in tags]
+        start = "TAIL"
+        for page in sorted(pages, key=lambda page: tags.index(page["tag"])):
+            if not self.intact(page):
+                log.debug("site: %s needs a rebuild", page["file"])
+                break
+            start = page["tag"]
+        log.debug("site: %s starts after %s", self.path, start)
+        return start
+
+    def intact(self, page):
+        """True if the page file is on disk, as the manifest says it was written."""
+        try:
+            with open(os.path.join(self.path, page["file"]), encoding="utf8") as fh:
+                return content_hash(fh.read()) == page["hash"]
+        except FileNotFoundError:
+            return False
+
+    def write(self):
+        """Write pages for the releases in runner.notes, if their content changed."""
+        os.makedirs(self.path, exist_ok=True)
+        new = []
+        written = 0
+        for tag, sections in self.runner.notes.items():
+            buf = io.StringIO()
+            self.runner.render_release(tag, sections, buf)
+            text = buf.getvalue()
+            page = {"tag": tag, "file": page_name(tag), "hash": content_hash(text)}
+            new.append(page)
+            # the file on disk decides, the manifest could be stale
+            if not self.intact(page):
+                self._write_file(page["file"], text)
+                written += 1
+
+        # older releases are kept as they are, transient ones are gone unless
+        # we just wrote them
+        done = {page["tag"] for page in new}
+        for page in self.pages:
+            if page["tag"] in done:
+                continue
+            if page["tag"] in TRANSIENT:
+                try:
+                    os.unlink(os.path.join(self.path, page["file"]))
+                except FileNotFoundError:
+                    pass
+                continue
+            if not self.intact(page):
+                log.warning(
+                    "site: %s is missing or changed, use --previous TAIL to rebuild it",
+                    page["file"],
+                )
+            new.append(page)
+        new.sort(key=lambda page: page["tag"] not in TRANSIENT)
+
+        index = io.StringIO()
+        print("Release Notes", file=index)
+        print("=============", file=index)
+        print(file=index)
+        for page in new:
+            name = "Current Branch" if page["tag"] == "HEAD" else page["tag"]
+            print("- [%s](%s)" % (name, page["file"]), file=index)
+        self._write_file(INDEX, index.getvalue(), only_if_changed=True)
+
+        self.pages = new
+        with open(os.path.join(self.path, MANIFEST), "w", encoding="utf8") as fh:
+            yaml.safe_dump({"pages": new}, fh, sort_keys=False)
+
+        print("Updated:", self.path, "(%d of %d pages written)" % (written, len(new)))
+
+    def _write_file(self, name, text, only_if_changed=False):
+        path = os.path.join(self.path, name)
+        if only_if_changed:
+            try:
+                with open(path, encoding="utf8") as fh:
+                    if fh.read() == text:
+                        return
+            except FileNotFoundError:
+                pass
+        log.debug("site: write %s", path)
+        with open(path, "w", encoding="utf8") as fh:
+            fh.write(text)
@@ -0,0 +1,77 @@
+"""rnotes --stream: write each release as soon as the log walk has passed it."""
+import sys
+import logging
+from collections import defaultdict
+
+import yaml
+
+log = logging.getLogger("rnotes")
+
+
+class Stream:
+    """Report that holds one release in memory at a time, instead of all of them."""
+
+    def __init__(self, runner):
+        self.runner = runner
+        self.num = 0
+        # a cached release owns its files, like in Runner.get_notes
+        self.seen = {
+            file: True for rec in runner.cached.values() for file in rec["files"]
+        }
+        self.notes = self.new_notes()
+
+    @staticmethod
+    def new_notes():
+        """Empty {tag: {section: [entries]}}, like Runner.notes."""
+        return defaultdict(lambda: defaultdict(lambda: []))
+
+    def run(self):
+        """Walk the log, then cached releases, then uncommitted notes, writing as we go."""
+        r = self.runner
+        if r.ver_start == "TAIL" or not r.ver_start:
+            vers = r.ver_end
+        else:
+            vers = r.ver_start + ".." + r.ver_end
+
+        # git log walks newest first: a tag decoration means every note of
+        # the newer release has been seen, so it can be written and dropped
+        lines = r.git_lines(*r.log_cmd(vers))
+        for tag, ct, cname, hsh, file in r.iter_logs(lines, r.ver_end, self.flush):
+            if self.seen.get(file):
+                continue
+            self.seen[file] = True
+            try:
+                r.load_note(tag, file, ct, cname, hsh, self.notes)
+            except FileNotFoundError:
+                pass
+        self.flush()
+
+        # older than anything in the log, newest first
+        for tag, rec in reversed(list(r.cached.items())):
+            for sec, ents in rec["notes"].items():
+                self.notes[tag][sec] += ents
+            self.flush()
+
+        r.load_worktree(self.seen, self.notes)
+        self.flush()
+
+        if r.args.yaml:
+            if not self.num:
+                print(yaml.dump({}), end="")
+        else:
+            # the trailing newline of a normal report
+            print()
+
+    def flush(self, _tag=None):
+        """Write the releases loaded so far, and forget them."""
+        for tag, sections in self.notes.items():
+            log.debug("stream: %s", tag)
+            if self.runner.args.yaml:
+                print(yaml.dump({tag: self.runner.release_yaml(tag, sections)}), end="")
+            else:
+                if self.num > 0:
+                    print()
+                self.runner.render_release(tag, sections)
+            self.num += 1
+            sys.stdout.flush()
+        self.notes = self.new_notes()
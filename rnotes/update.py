@@ -0,0 +1,68 @@
+"""rnotes --update: add new releases to the top of an existing report file."""
+import io
+import re
+import logging
+
+log = logging.getLogger("rnotes")
+
+
+class Update:
+    """Report file that keeps its older releases as they are."""
+
+    def __init__(self, runner, path):
+        self.runner = runner
+        self.path = path
+        self.keep = ""
+
+    def headings(self, text):
+        """Yield (tag, offset) for each release heading in text, newest first."""
+        tags = set(self.runner.tags)
+        lines = text.splitlines(keepends=True)
+        offset = 0
+        for i, line in enumerate(lines[:-1]):
+            head = line.rstrip("\r\n")
+            underline = lines[i + 1].rstrip("\r\n") == "=" * len(head)
+            # "tag" or "tag (date)"
+            head = re.sub(r" \(\d{4}-\d\d-\d\d\)$", "", head)
+            if head in tags and underline:
+                yield head, offset
+            offset += len(line)
+
+    def get_start(self, start):
+        """Return where the report should start, given --previous (or None).
+
+        Everything from the first release heading at or below the start is
+        kept as-is, newer releases are regenerated.
+        """
+        self.keep = ""
+        try:
+            with open(self.path, encoding="utf8", newline="") as fh:
+                text = fh.read()
+        except FileNotFoundError:
+            return start or "TAIL"
+
+        if start == "TAIL":
+            return start
+        tags = self.runner.tags
+        if start is not None:
+            assert start in tags, "--previous must be a release tag with --update"
+        for head, offset in self.headings(text):
+            if start is None or tags.index(head) <= tags.index(start):
+                log.debug("update: %s already has %s", self.path, head)
+                self.keep = text[offset:]
+                return start or head
+
+        # nothing we recognize, regenerate it all
+        return start or "TAIL"
+
+    def write(self):
+        """Write new releases to the top of the file, keeping the rest."""
+        buf = io.StringIO()
+        self.runner.get_report(buf)
+        new = buf.getvalue()
+        with open(self.path, "w", encoding="utf8", newline="") as fh:
+            if new:
+                fh.write(new)
+                fh.write("\n")
+            fh.write(self.keep)
+        print("Updated:", self.path)
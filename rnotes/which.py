@@ -0,0 +1,119 @@
+"""rnotes --which: the first release that shipped a note file, or some note text."""
+import os
+import os.path
+import re
+import json
+import logging
+
+log = logging.getLogger("rnotes")
+
+# under the git dir, so it's never committed
+INDEX_PATH = "rnotes/which-index.json"
+
+INDEX_VERSION = 1
+
+
+def tokens(text):
+    """Lowercase words in text, what the index is keyed on."""
+    return set(re.findall(r"\w+", text.lower()))
+
+
+class Which:
+    """Answer a --which query, from tag topology or the note text index."""
+
+    def __init__(self, runner, query):
+        self.runner = runner
+        self.query = query
+
+    def run(self):
+        """Print where query first shipped."""
+        r = self.runner
+        r.get_filters()
+        r.get_tags()
+        path = os.path.normpath(self.query).replace(os.sep, "/")
+        if r.backend.isfile(path) or path.endswith(".yaml"):
+            print(path + ":", self.find_file(path))
+            return
+        for tag, sec, note in self.find_text():
+            name = "Current Branch" if tag == "HEAD" else tag
+            print("%s  %s: %s" % (name, sec, note))
+
+    def find_file(self, path):
+        """Release that first contained the commit that added path."""
+        r = self.runner
+        # oldest add wins, if the note was deleted and added back later
+        added = r.git("log", "--diff-filter=A", "--format=%H", "--", path).split()
+        if not added:
+            assert r.backend.isfile(path), "%s: no such note" % path
+            return "Uncommitted"
+        commit = added[-1]
+        contains = set(r.git("tag", "--contains", commit).split())
+        # self.tags is oldest first, so the first hit is the first release
+        for tag in r.tags:
+            if tag in contains:
+                return "%s (added in %s)" % (tag, commit[:10])
+        return "not released yet (added in %s)" % commit[:10]
+
+    def find_text(self):
+        """Return [(tag, section, note)] for notes containing the query, oldest first."""
+        words = tokens(self.query)
+        assert words, "nothing to search for in %r" % self.query
+        index = self.get_index()
+        hits = None
+        for word in words:
+            posting = set(index["tokens"].get(word, []))
+            hits = posting if hits is None else hits & posting
+        want = self.query.lower()
+        found = [
+            tuple(index["entries"][i])
+            for i in sorted(hits)
+            if want in index["entries"][i][2].lower()
+        ]
+        assert found, "no note matches %r" % self.query
+        return found
+
+    def get_index(self):
+        """Load the text index, rebuild it if the fingerprint changed."""
+        r = self.runner
+        r.ver_start = "TAIL"
+        r.ver_end = "HEAD"
+        fingerprint = r.get_fingerprint()
+        path = r.git("rev-parse", "--git-path", INDEX_PATH).strip()
+        try:
+            index = json.loads(r.backend.read_file(path))
+            if (
+                index.get("version") == INDEX_VERSION
+                and index.get("fingerprint") == fingerprint
+            ):
+                log.debug("which: index is current")
+                return index
+        except (FileNotFoundError, ValueError):
+            pass
+
+        index = self.build_index()
+        index["version"] = INDEX_VERSION
+        index["fingerprint"] = fingerprint
+        r.backend.write_file(path, json.dumps(index, separators=(",", ":")))
+        return index
+
+    def build_index(self):
+        """Read the whole history, return {entries, tokens: {word: [entry numbers]}}."""
+        r = self.runner
+        log.debug("which: building index")
+        r.get_cached()
+        r.get_logs()
+        r.get_notes()
+        entries = []
+        index = {}
+        # notes are newest first with Uncommitted last, entries are numbered
+        # oldest first with Uncommitted last
+        tags = [tag for tag in reversed(list(r.notes)) if tag != "Uncommitted"]
+        if "Uncommitted" in r.notes:
+            tags.append("Uncommitted")
+        for tag in tags:
+            for sec, ents in r.notes[tag].items():
+                for ent in ents:
+                    for word in tokens(ent["note"]):
+                        index.setdefault(word, []).append(len(entries))
+                    entries.append((tag, sec, ent["note"]))
+        return {"entries": entries, "tokens": index}
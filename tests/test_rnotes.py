@@ -1,8 +1,13 @@
+import io
 import os
+import json
+import hashlib
 import re
 import yaml
 import sys
+import time
 import contextlib
+import subprocess
 import pytest
 import logging as log
 
@@ -10,6 +15,7 @@ from unittest.mock import patch
 
 from rnotes import Runner
 from rnotes.runner import normalize, Msg
+from rnotes.refs import find_git_dirs, read_tags, UnsupportedRepo
 from rnotes.main import parse_args, main
 
 
@@ -60,7 +66,10 @@ def test_report(capsys, tmp_run_with_notes):
 def gen_notes(runner, notes):
     for note in notes:
         with open(os.path.join(runner.notes_dir, note["name"]), "w") as n1:
-            yaml.dump(note["data"], n1)
+            if "text" in note:
+                n1.write(note["text"])
+            else:
+                yaml.dump(note["data"], n1)
             runner.git("add", runner.notes_dir)
             runner.git("commit", "-am", ".")
             if note.get("tag"):
@@ -173,6 +182,52 @@ def test_check_branch(capsys, monkeypatch, tmp_run_with_notes):
     assert "some stuff" in info["HEAD"]["release_summary"][0]["note"]
 
 
+def test_check_branches(capsys, monkeypatch, tmp_run_with_notes):
+    r = tmp_run_with_notes
+
+    def branch(name, files):
+        r.git("checkout", "-q", "-b", name, "master")
+        for file, text in files.items():
+            with open(file, "w", encoding="utf8") as fh:
+                fh.write(text)
+            r.git("add", file)
+        if files:
+            r.git("commit", "-m", ".")
+
+    branch("empty", {})
+    branch("nonote", {"dev.js": "some file"})
+    branch("note", {"dev.js": "some file", "notes/new.yaml": "features: new"})
+    branch("badnote", {"dev.js": "some file", "notes/bad.yaml": "bogus: bad"})
+    branch("onlynote", {"notes/only.yaml": "features: only"})
+    r.git("checkout", "-q", "master")
+
+    args = parse_args(
+        ["--notes-dir", r.notes_dir, "--check", "--target", "master"]
+        + ["--branches", "empty,note,onlynote"]
+    )
+    Runner(args).run()
+    out = capsys.readouterr().out
+    assert re.search(r"^note +pass +0 +found new note: notes/new.yaml$", out, re.M)
+    assert re.search(r"^empty +pass +0 ", out, re.M)
+
+    monkeypatch.setattr("sys.stdin", io.StringIO("nonote\nnote\nbadnote\n"))
+    args = parse_args(
+        ["--notes-dir", r.notes_dir, "--check", "--target", "master"]
+        + ["--branches", "-", "--jobs", "2"]
+    )
+    r = Runner(args)
+    with pytest.raises(AssertionError, match="2 of 3 branches failed"):
+        r.run()
+    out = capsys.readouterr().out
+    need = re.escape(r.message(Msg.NEED_NOTE))
+    assert re.search(r"^nonote +fail +1 +" + need, out, re.M)
+    assert re.search(r"^badnote +fail +1 +.*not a valid section", out, re.M)
+    assert re.search(r"^note +pass +0 ", out, re.M)
+
+    # the checked out branch is untouched
+    assert r.get_branch() == "master"
+
+
 def test_check_ignorables(capsys, tmp_run):
     r = tmp_run
     cfg = {
@@ -252,6 +307,940 @@ def test_missing_note(capsys, tmp_run_with_notes):
     assert "0.0.1" not in res
 
 
+def test_filter_sections(capsys, tmp_run_with_notes):
+    r = tmp_run_with_notes
+    args = parse_args(
+        ["--notes-dir", r.notes_dir, "--yaml", "--previous", "TAIL"]
+        + ["--sections", "release_summary"]
+    )
+    r = Runner(args)
+    r.run()
+    res = yaml.safe_load(capsys.readouterr().out)
+    assert res["0.0.1"]["release_summary"][0]["note"] == "summary 1"
+    assert "features" not in res["0.0.1"]
+
+    args = parse_args(["--notes-dir", r.notes_dir, "--sections", "bogus"])
+    r = Runner(args)
+    with pytest.raises(AssertionError, match=".*is not a valid section.*"):
+        r.run()
+
+
+def test_filter_sections_skips_parse(capsys, tmp_run_with_notes):
+    r = tmp_run_with_notes
+    args = parse_args(["--notes-dir", r.notes_dir, "--sections", "internal"])
+    r = Runner(args)
+    with patch("rnotes.runner.yaml.safe_load") as load:
+        r.run()
+    load.assert_not_called()
+
+    # keys the line check can't see: always parsed
+    gen_notes(
+        r,
+        [
+            {"name": "flow.yaml", "text": "{features: flow note}"},
+            {"name": "indented.yaml", "text": "  features: indented note"},
+        ],
+    )
+    for sections in ("features", "internal"):
+        args = parse_args(["--notes-dir", r.notes_dir, "--sections", sections])
+        Runner(args).run()
+        out = capsys.readouterr().out
+        assert ("- flow note" in out) == (sections == "features")
+        assert ("- indented note" in out) == (sections == "features")
+
+
+def test_filter_author(capsys, tmp_run_with_notes):
+    r = tmp_run_with_notes
+    with open(r.notes_dir + "/other.yaml", "w", encoding="utf8") as fh:
+        fh.write("features: other feature")
+    r.git("add", r.notes_dir + "/other.yaml")
+    r.git("-c", "user.name=Other Person", "commit", "-m", ".")
+
+    args = parse_args(
+        ["--notes-dir", r.notes_dir, "--previous", "TAIL", "--author", "^Other"]
+    )
+    r = Runner(args)
+    r.run()
+    out = capsys.readouterr().out
+    assert "other feature" in out
+    assert "feature 2" not in out
+    assert "feature 1" not in out
+
+
+def test_filter_dates(capsys, tmp_run_with_notes):
+    r = tmp_run_with_notes
+    with open(r.notes_dir + "/mynote.yaml", "w", encoding="utf8") as fh:
+        fh.write("features: uncommitted feature")
+    r.git("add", r.notes_dir + "/mynote.yaml")
+
+    args = parse_args(
+        ["--notes-dir", r.notes_dir, "--previous", "TAIL", "--since", "2000-01-01"]
+    )
+    r = Runner(args)
+    r.run()
+    out = capsys.readouterr().out
+    assert "feature 1" in out
+    assert "feature 2" in out
+    assert "uncommitted feature" in out
+
+    args = parse_args(
+        ["--notes-dir", r.notes_dir, "--previous", "TAIL", "--until", "2000-01-01"]
+    )
+    r = Runner(args)
+    r.run()
+    out = capsys.readouterr().out
+    assert "feature" not in out
+    assert r.until_ts and r.since_ts is None
+
+
+def test_update(capsys, tmp_run_with_notes):
+    r = tmp_run_with_notes
+    args = parse_args(["--notes-dir", r.notes_dir, "--previous", "TAIL"])
+    Runner(args).run()
+    full = capsys.readouterr().out
+
+    # no file: same as a full report
+    args = parse_args(["--notes-dir", r.notes_dir, "--update", "RELEASE_NOTES"])
+    Runner(args).run()
+    with open("RELEASE_NOTES", encoding="utf8") as fh:
+        assert fh.read() == full
+
+    # old sections are never regenerated
+    with open("RELEASE_NOTES", encoding="utf8") as fh:
+        old = fh.read().replace("feature 1", "feature one")
+    with open("RELEASE_NOTES", "w", encoding="utf8") as fh:
+        fh.write(old)
+
+    gen_notes(
+        r,
+        [{"name": "note3.yaml", "data": {"features": ["feature 3"]}}],
+    )
+    Runner(args).run()
+    with open("RELEASE_NOTES", encoding="utf8") as fh:
+        res = fh.read()
+    assert res.startswith("Current Branch\n")
+    assert res.endswith("\n" + old)
+
+    # current branch is replaced once tagged
+    r.git("tag", "0.0.3")
+    Runner(args).run()
+    with open("RELEASE_NOTES", encoding="utf8") as fh:
+        res = fh.read()
+    assert "Current Branch" not in res
+    assert re.match(r"0\.0\.3 \(\d{4}-\d\d-\d\d\)\n", res)
+    assert res.count("feature 3") == 1
+    assert res.endswith("\n" + old)
+
+    # --previous: releases after it are regenerated, the rest is kept
+    gen_notes(r, [{"name": "note4.yaml", "data": {"features": ["feature 4"]}}])
+    prev = parse_args(
+        ["--notes-dir", r.notes_dir, "--update", "RELEASE_NOTES", "--previous", "0.0.2"]
+    )
+    Runner(prev).run()
+    with open("RELEASE_NOTES", encoding="utf8") as fh:
+        new = fh.read()
+    assert new.startswith("Current Branch\n")
+    assert new.count("feature 3") == new.count("feature 4") == 1
+    assert new.endswith("\n" + res[res.index("0.0.2 (") :])
+    assert "feature one" in new
+
+    prev.previous = "TAIL"
+    Runner(prev).run()
+    with open("RELEASE_NOTES", encoding="utf8") as fh:
+        new = fh.read()
+    assert "feature one" not in new
+    assert new.count("feature 1") == new.count("feature 4") == 1
+
+    prev.previous = "HEAD~1"
+    with pytest.raises(AssertionError, match="must be a release tag"):
+        Runner(prev).run()
+
+
+def test_tag_info(capsys, tmp_run_with_notes):
+    r = tmp_run_with_notes
+    gen_notes(r, [{"name": "note3.yaml", "data": {"features": ["feature 3"]}}])
+    env = dict(os.environ, GIT_COMMITTER_DATE="2022-10-14T12:00:00")
+    with patch.dict(os.environ, env):
+        r.git("tag", "-a", "0.0.3", "-m", "Release 0.0.3\n\nThe third one.")
+    commit = r.git("rev-parse", "HEAD").strip()
+    # what ssh and gpg signed tags look like, without needing a key
+    signed = r.git(
+        "mktag",
+        stdin="object %s\ntype commit\ntag 0.0.2\n"
+        "tagger test user <test@example.com> 1665748800 +0000\n\n"
+        "Signed 0.0.2\n"
+        "-----BEGIN SSH SIGNATURE-----\nU1NIU0lHAAAAAQ==\n-----END SSH SIGNATURE-----\n"
+        % r.git("rev-parse", "0.0.2").strip(),
+    ).strip()
+    r.git("update-ref", "refs/tags/0.0.2", signed)
+
+    args = parse_args(["--notes-dir", r.notes_dir, "--previous", "TAIL", "--yaml"])
+    r = Runner(args)
+    calls = []
+    func = r.git
+    r.git = lambda *args, **kw: calls.append(args) or func(*args, **kw)
+    r.run()
+    # one call for every tag, nothing per tag
+    assert len([c for c in calls if c[-1] == "refs/tags/"]) == 1
+    res = yaml.safe_load(capsys.readouterr().out)
+    info = res["0.0.3"]["_release"]
+    assert info["commit"] == commit
+    assert info["message"] == "Release 0.0.3\n\nThe third one."
+    assert time.strftime("%Y-%m-%d", time.localtime(info["time"])) == "2022-10-14"
+    # lightweight tag: commit date, no message
+    assert res["0.0.1"]["_release"]["message"] == ""
+    # signed tag: the signature isn't part of the message
+    assert res["0.0.2"]["_release"]["message"] == "Signed 0.0.2"
+    assert res["0.0.1"]["features"][0]["note"] == "feature 1"
+
+    args = parse_args(["--notes-dir", r.notes_dir, "--previous", "TAIL"])
+    Runner(args).run()
+    out = capsys.readouterr().out
+    assert out.startswith("0.0.3 (2022-10-14)\n==================\n")
+    assert re.search(r"^0\.0\.1 \(\d{4}-\d\d-\d\d\)$", out, re.M)
+
+    # --update still knows headings written without a date
+    with open("RELEASE_NOTES", "w", encoding="utf8") as fh:
+        fh.write("0.0.2\n=====\n\nkept\n")
+    args = parse_args(["--notes-dir", r.notes_dir, "--update", "RELEASE_NOTES"])
+    Runner(args).run()
+    with open("RELEASE_NOTES", encoding="utf8") as fh:
+        res = fh.read()
+    assert res.startswith("0.0.3 (2022-10-14)\n")
+    assert res.endswith("\n0.0.2\n=====\n\nkept\n")
+
+
+def test_parallel_logs(tmp_run_with_notes):
+    r = tmp_run_with_notes
+    gen_notes(r, [{"name": "note3.yaml", "data": {"features": ["f3"]}}])
+    # tag with no new files: invisible to git log --diff-filter=A
+    r.git("commit", "--allow-empty", "-m", ".")
+    r.git("tag", "0.0.3")
+    gen_notes(
+        r,
+        [
+            {"name": "note4.yaml", "data": {"features": ["f4"]}, "tag": "0.0.4"},
+            {"name": "note5.yaml", "data": {"features": ["f5"]}, "tag": "not-a-ver"},
+            {"name": "note6.yaml", "data": {"features": ["f6"]}, "tag": "0.0.6"},
+            {"name": "note7.yaml", "data": {"features": ["f7"]}},
+        ],
+    )
+
+    def scan(extra):
+        args = parse_args(["--notes-dir", r.notes_dir] + extra)
+        run = Runner(args)
+        run.get_tags()
+        run.get_start_from_end()
+        run.get_logs()
+        return run.logs
+
+    def same(rng):
+        serial = scan(rng)
+        assert serial
+        assert scan(rng + ["--jobs", "2"]) == serial
+        assert scan(rng + ["--jobs", "0"]) == serial
+        return serial
+
+    def shards():
+        run = Runner(parse_args(["--notes-dir", r.notes_dir, "--previous", "TAIL"]))
+        run.args.jobs = 2
+        run.get_tags()
+        run.get_start_from_end()
+        return run.tags, run.get_shards()
+
+    for rng in (["--previous", "TAIL"], ["--previous", "0.0.1"], []):
+        same(rng)
+
+    # a release tagged on a branch that was never merged: git log never sees it
+    r.git("checkout", "-q", "-b", "side", "0.0.4")
+    gen_notes(r, [{"name": "side.yaml", "data": {"features": ["s"]}, "tag": "0.0.5"}])
+    r.git("checkout", "-q", "master")
+    tags, shards_ = shards()
+    assert "0.0.5" in tags
+    assert shards_ and not [shard for shard in shards_ if "0.0.5" in shard]
+    for rng in (["--previous", "TAIL"], ["--previous", "0.0.1"]):
+        assert "notes/side.yaml" not in [ent[4] for ent in same(rng)]
+
+    # a branch merged after a release: no shards, git log order decides
+    r.git("checkout", "-q", "-b", "feature", "0.0.6")
+    gen_notes(r, [{"name": "feature.yaml", "data": {"features": ["f"]}}])
+    r.git("checkout", "-q", "master")
+    gen_notes(r, [{"name": "note8.yaml", "data": {"features": ["f8"]}, "tag": "0.0.8"}])
+    r.git("merge", "-q", "--no-ff", "-m", "merge", "feature")
+    gen_notes(r, [{"name": "note9.yaml", "data": {"features": ["f9"]}, "tag": "0.0.9"}])
+    assert shards()[1] is None
+    assert "notes/feature.yaml" in [ent[4] for ent in same(["--previous", "TAIL"])]
+    # still split where the history before the merge is linear
+    same(["--previous", "0.0.1", "--version", "0.0.6"])
+
+
+def test_parallel_logs_split(tmp_run, monkeypatch):
+    r = tmp_run
+
+    def commit(name, tag=None, when=None):
+        commit.when += 1
+        monkeypatch.setenv("GIT_COMMITTER_DATE", "%d +0000" % (when or commit.when))
+        gen_notes(r, [{"name": name, "data": {"features": [name]}, "tag": tag}])
+
+    commit.when = 2000000000
+
+    def merge(branch, when=None):
+        r.git("checkout", "-q", "-b", branch, "0.0.4")
+        commit(branch + ".yaml", when=when)
+        r.git("checkout", "-q", "master")
+        commit.when += 1
+        monkeypatch.setenv("GIT_COMMITTER_DATE", "%d +0000" % commit.when)
+        r.git("merge", "-q", "--no-ff", "-m", "merge", branch)
+
+    def scan(jobs):
+        run = Runner(parse_args(["--notes-dir", r.notes_dir, "--previous", "TAIL"]))
+        run.args.jobs = jobs
+        run.get_tags()
+        run.get_start_from_end()
+        shards = run.get_shards()
+        run.get_logs()
+        return shards, run.logs
+
+    for i in range(1, 5):
+        commit("note%d.yaml" % i, "0.0.%d" % i)
+    merge("feature")
+    commit("note5.yaml", "0.0.5")
+
+    # the merge is above 0.0.4: one serial shard above it, split below it
+    shards, logs = scan(2)
+    assert shards[0] == "0.0.4..0.0.5"
+    assert len(shards) > 2
+    assert logs == scan(None)[1]
+    assert ("0.0.5", "notes/feature.yaml") in [(ent[0], ent[4]) for ent in logs]
+
+    # a commit older than 0.0.4 above it: date order interleaves, all serial
+    merge("skewed", when=commit.when - 100)
+    shards, logs = scan(2)
+    assert shards is None
+    assert logs == scan(None)[1]
+
+
+def test_shards(tmp_run_with_notes):
+    r = tmp_run_with_notes
+    args = parse_args(["--notes-dir", r.notes_dir, "--jobs", "1"])
+    r = Runner(args)
+    r.tags = [str(i) for i in range(10)]
+    r.ver_start = "TAIL"
+    with mock_git(r, r"tag --merged", "\n".join(r.tags)):
+        shards = r.get_shards()
+    # 4 per worker, newest first
+    assert len(shards) == 4
+    assert shards[0].endswith("..HEAD")
+    assert "..8" not in shards[0]
+    assert shards[-1] == "2"
+
+    r.ver_start = "9"
+    assert r.get_shards() is None
+    r.ver_start = "not-a-tag"
+    assert r.get_shards() is None
+
+
+def test_native_tags(tmp_run, monkeypatch):
+    r = tmp_run
+
+    def commit(note):
+        # distinct commit times, so git log --tags order is well defined
+        commit.when += 1
+        monkeypatch.setenv("GIT_COMMITTER_DATE", "%d +0000" % commit.when)
+        gen_notes(r, [{"name": note, "data": {"features": [note]}}])
+
+    commit.when = 2000000000
+
+    commit("note1.yaml")
+    r.git("tag", "0.0.1")
+    commit("note2.yaml")
+    r.git("tag", "0.0.2")
+    commit("note3.yaml")
+    r.git("tag", "-a", "0.0.3", "-m", "annotated")
+    r.git("tag", "not-a-ver", "HEAD~3")
+    r.git("pack-refs", "--all")
+    commit("note4.yaml")
+    r.git("tag", "sub/0.0.5")
+    commit("note5.yaml")
+    r.git("tag", "-a", "0.0.4", "-m", "annotated, loose")
+
+    def tags(r, calls=None):
+        r = Runner(r.args)
+        if calls is not None:
+            func = r.git
+            r.git = lambda *args, **kw: calls.append((args, kw)) or func(*args, **kw)
+        r.get_tags()
+        return r.tags, r.ver_end
+
+    calls = []
+    native = tags(r, calls)
+    assert native == (["0.0.1", "0.0.2", "0.0.3", "0.0.4"], "0.0.4")
+    # one git call to sort, peeled commits in, where packed-refs has them
+    logs = [c for c in calls if c[0][0] == "log"]
+    assert len(logs) == 1
+    args, kw = logs[0]
+    assert "--no-walk" in args
+    stdin = kw["stdin"].split("\n")
+    assert r.git("rev-parse", "0.0.3^{commit}").strip() in stdin
+    assert r.git("rev-parse", "0.0.4").strip() in stdin
+    assert len(stdin) == 4
+
+    with patch("rnotes.backend.find_git_dirs", side_effect=UnsupportedRepo("test")):
+        assert tags(r) == native
+
+    _, common = find_git_dirs()
+    refs = read_tags(common)
+    assert set(refs) == {"0.0.1", "0.0.2", "0.0.3", "0.0.4", "not-a-ver", "sub/0.0.5"}
+    sha, peeled = refs["0.0.3"]
+    assert peeled == r.git("rev-parse", "0.0.3^{commit}").strip() != sha
+    sha, peeled = refs["0.0.1"]
+    assert peeled == sha
+
+    r.git("worktree", "add", "wt", "0.0.2")
+    os.chdir("wt")
+    git_dir, wt_common = find_git_dirs()
+    assert wt_common == common != git_dir
+    native = tags(r)
+    assert native == (["0.0.1", "0.0.2", "0.0.3", "0.0.4"], "0.0.2")
+
+
+def test_native_tags_unsupported(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(UnsupportedRepo):
+        find_git_dirs()
+    monkeypatch.setenv("GIT_DIR", str(tmp_path))
+    with pytest.raises(UnsupportedRepo):
+        find_git_dirs()
+
+
+def test_site(capsys, tmp_run_with_notes):
+    r = tmp_run_with_notes
+    argv = ["--notes-dir", r.notes_dir, "--site", "site"]
+    args = parse_args(argv)
+    Runner(args).run()
+    assert sorted(os.listdir("site")) == [
+        ".rnotes-manifest.yaml",
+        "0.0.1.md",
+        "0.0.2.md",
+        "index.md",
+    ]
+    with open("site/0.0.1.md", encoding="utf8") as fh:
+        assert "feature 1" in fh.read()
+    with open("site/index.md", encoding="utf8") as fh:
+        assert "- [0.0.2](0.0.2.md)\n- [0.0.1](0.0.1.md)\n" in fh.read()
+
+    # a page changed on disk is rebuilt, the manifest doesn't vouch for it
+    with open("site/0.0.1.md", "w", encoding="utf8") as fh:
+        fh.write("corrupted")
+
+    gen_notes(r, [{"name": "note3.yaml", "data": {"features": ["feature 3"]}}])
+    Runner(args).run()
+    assert "2 of 3 pages written" in capsys.readouterr().out
+    with open("site/current-branch.md", encoding="utf8") as fh:
+        assert "feature 3" in fh.read()
+    with open("site/0.0.1.md", encoding="utf8") as fh:
+        assert "feature 1" in fh.read()
+
+    # nothing changed, nothing written
+    Runner(args).run()
+    assert "0 of 3 pages written" in capsys.readouterr().out
+
+    # so is a deleted one
+    os.unlink("site/0.0.1.md")
+    Runner(args).run()
+    assert "1 of 3 pages written" in capsys.readouterr().out
+    with open("site/0.0.1.md", encoding="utf8") as fh:
+        assert "feature 1" in fh.read()
+
+    # finalized pages are frozen, unless rebuilt with --previous
+    with open(r.notes_dir + "/note1.yaml", "w", encoding="utf8") as fh:
+        fh.write("features: feature 1 edited")
+    r.git("commit", "-qam", "edit")
+    Runner(args).run()
+    assert "0 of 3 pages written" in capsys.readouterr().out
+    Runner(parse_args(argv + ["--previous", "TAIL"])).run()
+    assert "1 of 3 pages written" in capsys.readouterr().out
+    with open("site/0.0.1.md", encoding="utf8") as fh:
+        assert "feature 1 edited" in fh.read()
+
+    # tagging turns the current branch page into a release page
+    r.git("tag", "0.0.3")
+    Runner(args).run()
+    assert "1 of 3 pages written" in capsys.readouterr().out
+    assert not os.path.exists("site/current-branch.md")
+    with open("site/index.md", encoding="utf8") as fh:
+        assert "- [0.0.3](0.0.3.md)\n- [0.0.2](0.0.2.md)\n" in fh.read()
+
+
+def test_fingerprint(capsys, tmp_run_with_notes):
+    r = tmp_run_with_notes
+
+    def fingerprint(*extra):
+        args = parse_args(["--notes-dir", r.notes_dir, "--fingerprint", *extra])
+        run = Runner(args)
+        cmds = []
+        func = run.git
+
+        def git(*args, **kwargs):
+            cmds.append(args)
+            return func(*args, **kwargs)
+
+        run.git = git
+        run.run()
+        # no history walk
+        assert all("--no-walk" in cmd for cmd in cmds if cmd[0] == "log")
+        out = capsys.readouterr().out.strip()
+        assert re.match(r"^[0-9a-f]{64}$", out)
+        return out
+
+    first = fingerprint()
+    assert fingerprint() == first
+    assert fingerprint("--blame") != first
+    assert fingerprint("--previous", "TAIL") != first
+
+    seen = {first}
+
+    def changed():
+        fp = fingerprint()
+        assert fp not in seen
+        seen.add(fp)
+
+    with open(r.notes_dir + "/new.yaml", "w", encoding="utf8") as fh:
+        fh.write("features: new")
+    changed()
+    with open(r.notes_dir + "/new.yaml", "w", encoding="utf8") as fh:
+        fh.write("features: newer")
+    changed()
+    r.git("add", r.notes_dir + "/new.yaml")
+    changed()
+    r.git("commit", "-m", ".")
+    changed()
+    r.git("tag", "0.0.3")
+    changed()
+    with open("rnotes.yaml", "w", encoding="utf8") as fh:
+        fh.write("sections: [[features, Features]]")
+    changed()
+
+    # unrelated changes don't matter
+    r.git("tag", "unrelated", "HEAD~3")
+    with open("README", "w", encoding="utf8") as fh:
+        fh.write("changed")
+    assert fingerprint() in seen
+
+
+def test_notes_cache(capsys, tmp_run_with_notes):
+    r = tmp_run_with_notes
+    gen_notes(
+        r,
+        [
+            {"name": "note3.yaml", "data": {"features": ["f3"]}, "tag": "0.0.3"},
+            {"name": "note4.yaml", "data": {"features": ["f4"]}},
+        ],
+    )
+
+    def report():
+        args = parse_args(["--notes-dir", r.notes_dir, "--yaml", "--previous", "TAIL"])
+        run = Runner(args)
+        run.run()
+        return run, yaml.safe_load(capsys.readouterr().out)
+
+    uncached, expect = report()
+    assert not uncached.cached
+
+    args = parse_args(["--notes-dir", r.notes_dir, "--publish-cache"])
+    Runner(args).run()
+    assert "(3 releases)" in capsys.readouterr().out
+    assert "f3" in r.git("notes", "--ref", "rnotes", "show", "0.0.3")
+
+    cached, res = report()
+    assert res == expect
+    assert list(cached.cached) == ["0.0.1", "0.0.2", "0.0.3"]
+    # only the current branch was walked
+    assert [ent[0] for ent in cached.logs] == ["HEAD"]
+
+    # outdated: note edited after publishing
+    with open(r.notes_dir + "/note2.yaml", "w", encoding="utf8") as fh:
+        fh.write("features: edited")
+    cached, res = report()
+    assert list(cached.cached) == ["0.0.1"]
+    assert res["0.0.2"]["features"][0]["note"] == "edited"
+    r.git("commit", "-am", ".")
+    cached, res = report()
+    assert list(cached.cached) == ["0.0.1"]
+    assert res["0.0.2"]["features"][0]["note"] == "edited"
+
+    # republish only walks what isn't cached
+    Runner(args).run()
+    cached, res = report()
+    assert list(cached.cached) == ["0.0.1", "0.0.2", "0.0.3"]
+    assert res["0.0.2"]["features"][0]["note"] == "edited"
+
+    # tampered: membership doesn't match the repo
+    blob = r.git("notes", "--ref", "rnotes", "show", "0.0.1")
+    r.git(
+        "notes",
+        "--ref",
+        "rnotes",
+        "add",
+        "-f",
+        "-m",
+        blob.replace("note1.yaml", "note9.yaml"),
+        "0.0.1",
+    )
+    cached, res = report()
+    assert not cached.cached
+    assert res["0.0.1"]["features"][0]["note"] == "feature 1"
+
+    # tampered: entries edited, files left alone
+    Runner(args).run()
+    capsys.readouterr()
+    blob = r.git("notes", "--ref", "rnotes", "show", "0.0.2")
+    assert "note: edited" in blob
+    r.git(
+        "notes",
+        "--ref",
+        "rnotes",
+        "add",
+        "-f",
+        "-m",
+        blob.replace("note: edited", "note: sneaky"),
+        "0.0.2",
+    )
+    cached, res = report()
+    assert list(cached.cached) == ["0.0.1"]
+    assert res["0.0.2"]["features"][0]["note"] == "edited"
+
+    # tampered: an entry added, the record is otherwise consistent
+    rec = yaml.safe_load(blob)
+    ent = dict(rec["0.0.2"]["notes"]["features"][0], note="INJECTED")
+    rec["0.0.2"]["notes"]["features"].append(ent)
+    # records used to carry a digest, which anyone can recompute
+    data = json.dumps([rec["0.0.2"]["files"], rec["0.0.2"]["notes"]], sort_keys=True)
+    rec["0.0.2"]["digest"] = hashlib.sha256(data.encode("utf8")).hexdigest()
+    r.git("notes", "--ref", "rnotes", "add", "-f", "-m", yaml.safe_dump(rec), "0.0.2")
+    cached, res = report()
+    assert list(cached.cached) == ["0.0.1"]
+    assert "INJECTED" not in str(res)
+
+
+def test_notes_cache_merge(capsys, tmp_run_with_notes):
+    r = tmp_run_with_notes
+    # written long ago on a branch, merged after the last release
+    r.git("checkout", "-q", "-b", "feature", "0.0.1")
+    with patch.dict(os.environ, {"GIT_COMMITTER_DATE": "2000-01-01T00:00:00"}):
+        gen_notes(r, [{"name": "old.yaml", "data": {"features": ["old"]}}])
+    r.git("checkout", "-q", "master")
+    r.git("merge", "-q", "--no-ff", "-m", "merge", "feature")
+    gen_notes(r, [{"name": "note3.yaml", "data": {"features": ["f3"]}}])
+
+    def report(*extra):
+        args = parse_args(["--notes-dir", r.notes_dir, "--previous", "TAIL", *extra])
+        run = Runner(args)
+        run.run()
+        return run, capsys.readouterr().out
+
+    Runner(parse_args(["--notes-dir", r.notes_dir, "--publish-cache"])).run()
+    assert "(2 releases)" in capsys.readouterr().out
+    r.git("tag", "0.0.3")
+
+    # the merge brings old.yaml back into the walked part of the log
+    cached, out = report()
+    assert list(cached.cached) == ["0.0.1", "0.0.2"]
+    assert "- old\n" in out
+    assert report("--stream")[1] == out
+
+    r.git("update-ref", "-d", "refs/notes/rnotes")
+    uncached, expect = report()
+    assert not uncached.cached
+    assert out == expect
+    assert expect.count("- old\n") == 1
+
+
+def test_doctor(capsys, tmp_run_with_notes):
+    r = tmp_run_with_notes
+    for i in range(5):
+        r.git("tag", "0.0.2-nightly.%d" % i)
+    sections = {"sections": [["features", "New Features"]]}
+    with open("rnotes.yaml", "w", encoding="utf8") as fh:
+        yaml.dump({"earliest_version": "0.0.0", "notes_dir": "notes", **sections}, fh)
+
+    args = parse_args(["--doctor"])
+    Runner(args).run()
+    out = capsys.readouterr().out
+    for phase in ("get_tags", "get_logs", "get_notes", "get_report"):
+        assert re.search(r"^%s +[\d.]+s$" % phase, out, re.M)
+    assert re.search(r"^release tags +7$", out, re.M)
+    assert "earliest_version '0.0.0' is not a tag" in out
+    assert "matches 5 tags that only start like a version" in out
+    assert "suggest: release_tag_re: ^v?((?:[\\d.ab]|rc)+)$" in out
+    assert "no commit-graph" in out
+
+    r.git("commit-graph", "write", "--reachable")
+    with open("rnotes.yaml", "w", encoding="utf8") as fh:
+        yaml.dump(
+            {
+                "earliest_version": "0.0.1",
+                "notes_dir": "notes",
+                "release_tag_re": r"^v?((?:[\d.ab]|rc)+)$",
+                **sections,
+            },
+            fh,
+        )
+    Runner(args).run()
+    out = capsys.readouterr().out
+    assert re.search(r"^release tags +2$", out, re.M)
+    assert "No problems found." in out
+
+
+def test_record_replay(capsys, tmp_run_with_notes, tmp_path_factory, monkeypatch):
+    r = tmp_run_with_notes
+    with open(r.notes_dir + "/mynote.yaml", "w", encoding="utf8") as fh:
+        fh.write("release_summary: some stuff")
+    capture = str(tmp_path_factory.mktemp("capture") / "run.rnotes.gz")
+    repo = os.getcwd()
+
+    for extra in (
+        [],
+        ["--yaml"],
+        ["--previous", "TAIL", "--blame", "--jobs", "2"],
+        ["--stream"],
+    ):
+        args = parse_args(["--notes-dir", r.notes_dir, "--record", capture] + extra)
+        Runner(args).run()
+        recorded = capsys.readouterr().out
+        assert "some stuff" in recorded
+
+        # no repo here at all
+        monkeypatch.chdir(tmp_path_factory.mktemp("empty"))
+        args = parse_args(["--notes-dir", r.notes_dir, "--replay", capture] + extra)
+        with patch("rnotes.backend.subprocess.run", side_effect=AssertionError):
+            Runner(args).run()
+        assert capsys.readouterr().out == recorded
+        monkeypatch.chdir(repo)
+
+    # commands that look at the repo themselves, not just through git
+    for extra in (
+        ["--doctor"],
+        ["--which", "feature 1"],
+        ["--which", "notes/note2.yaml"],
+    ):
+        args = parse_args(["--notes-dir", r.notes_dir, "--record", capture] + extra)
+        Runner(args).run()
+        recorded = capsys.readouterr().out
+        assert "Findings" in recorded or "0.0." in recorded
+
+        monkeypatch.chdir(tmp_path_factory.mktemp("empty"))
+        args = parse_args(["--notes-dir", r.notes_dir, "--replay", capture] + extra)
+        with patch("rnotes.backend.subprocess.run", side_effect=AssertionError):
+            Runner(args).run()
+        # timings differ from run to run
+        numbers = re.compile(r"\d+\.\d+")
+        assert numbers.sub("N", capsys.readouterr().out) == numbers.sub("N", recorded)
+        assert not os.listdir(".")
+        monkeypatch.chdir(repo)
+
+    # something that wasn't recorded
+    args = parse_args(["--notes-dir", r.notes_dir, "--replay", capture, "--lint"])
+    with pytest.raises(AssertionError, match="not in capture"):
+        Runner(args).run()
+
+
+def test_stream(capsys, tmp_run_with_notes):
+    r = tmp_run_with_notes
+    gen_notes(r, [{"name": "note3.yaml", "data": {"features": ["feature 3"]}}])
+    # edited after its release: the current text is reported, even with --version
+    gen_notes(r, [{"name": "note1.yaml", "data": {"features": ["feature 1 edited"]}}])
+    with open(r.notes_dir + "/mynote.yaml", "w", encoding="utf8") as fh:
+        fh.write("release_summary: some stuff")
+    r.git("add", r.notes_dir + "/mynote.yaml")
+
+    for extra in (
+        [],
+        ["--previous", "TAIL", "--blame"],
+        ["--version", "0.0.2"],
+        ["--version", "0.0.2", "--previous", "TAIL"],
+    ):
+        args = parse_args(["--notes-dir", r.notes_dir] + extra)
+        Runner(args).run()
+        report = capsys.readouterr().out
+        Runner(parse_args(["--notes-dir", r.notes_dir, "--stream"] + extra)).run()
+        assert capsys.readouterr().out == report
+    assert "feature 1 edited" in report
+
+    args = ["--notes-dir", r.notes_dir, "--yaml", "--previous", "TAIL"]
+    Runner(parse_args(args)).run()
+    report = yaml.safe_load(capsys.readouterr().out)
+    Runner(parse_args(args + ["--stream"])).run()
+    out = capsys.readouterr().out
+    assert yaml.safe_load(out) == report
+    # history order, not sorted
+    assert out.index("HEAD:") < out.index("0.0.2:") < out.index("0.0.1:")
+    assert out.index("0.0.1:") < out.index("Uncommitted:")
+
+    # a release is written as soon as the walk passes its tag
+    r = Runner(
+        parse_args(["--notes-dir", r.notes_dir, "--stream", "--previous", "TAIL"])
+    )
+    func = r.git_lines
+
+    def git_lines(*args):
+        crossed = False
+        for line in func(*args):
+            if crossed:
+                assert "feature 2" in capsys.readouterr().out
+            crossed = "tag: 0.0.1" in line
+            yield line
+
+    r.git_lines = git_lines
+    r.run()
+    assert "feature 1" in capsys.readouterr().out
+
+    with pytest.raises(AssertionError, match="--update can't be used with --stream"):
+        Runner(parse_args(["--notes-dir", "notes", "--stream", "--update", "x"])).run()
+
+
+def test_which(capsys, tmp_run_with_notes):
+    r = tmp_run_with_notes
+    gen_notes(r, [{"name": "note3.yaml", "data": {"features": ["feature 3"]}}])
+    with open(r.notes_dir + "/mynote.yaml", "w", encoding="utf8") as fh:
+        fh.write("features: some stuff")
+
+    def which(query):
+        Runner(parse_args(["--notes-dir", r.notes_dir, "--which", query])).run()
+        return capsys.readouterr().out
+
+    assert re.match(
+        r"notes/note1.yaml: 0.0.1 \(added in \w+\)$", which("notes/note1.yaml")
+    )
+    assert which("./notes/note2.yaml").startswith("notes/note2.yaml: 0.0.2 ")
+    assert "not released yet" in which("notes/note3.yaml")
+    assert which("notes/mynote.yaml") == "notes/mynote.yaml: Uncommitted\n"
+    with pytest.raises(AssertionError, match="no such note"):
+        which("notes/nope.yaml")
+
+    assert which("Feature 1") == "0.0.1  features: feature 1\n"
+    assert which("summary") == (
+        "0.0.1  release_summary: summary 1\n0.0.2  release_summary: summary 2\n"
+    )
+    assert which("stuff") == "Uncommitted  features: some stuff\n"
+
+    # second lookup is served from the index
+    with patch("rnotes.which.Which.build_index", side_effect=AssertionError):
+        assert which("feature 3") == "Current Branch  features: feature 3\n"
+        with pytest.raises(AssertionError, match="no note matches"):
+            which("feature 4")
+
+    # new notes invalidate it
+    with open(r.notes_dir + "/mynote.yaml", "w", encoding="utf8") as fh:
+        fh.write("features: feature 4")
+    assert which("feature 4") == "Uncommitted  features: feature 4\n"
+
+
+def gen_reno_tree(runner, releases, per_release=1):
+    """Reno layout: releasenotes/notes/<slug>-<hex>.yaml, one commit and tag per release."""
+    os.makedirs("releasenotes/notes", exist_ok=True)
+    for num, sections in enumerate(releases):
+        for i in range(per_release):
+            name = "releasenotes/notes/note-%d-%d-%016x.yaml" % (num, i, num * 1000 + i)
+            data = {
+                sec: [ent % (num, i) for ent in ents] if type(ents) is list else ents
+                for sec, ents in sections.items()
+            }
+            with open(name, "w", encoding="utf8") as fh:
+                fh.write("---\n" + yaml.dump(data))
+        runner.git("add", "releasenotes")
+        runner.git("commit", "-m", "release %d" % num)
+        runner.git("tag", "1.%d.0" % num)
+
+
+def test_reno(capsys, tmp_run):
+    r = tmp_run
+    gen_reno_tree(
+        r,
+        [
+            {"prelude": "The first one.", "features": ["feature %d.%d"]},
+            {"fixes": ["fix %d.%d"], "upgrade": "upgrade notes"},
+        ],
+    )
+
+    Runner(parse_args(["--reno", "--previous", "TAIL"])).run()
+    out = capsys.readouterr().out
+    assert re.search(r"^1\.1\.0 \(\d{4}-\d\d-\d\d\)$", out, re.M)
+    assert "Bug Fixes\n---------\n- fix 1.0\n" in out
+    assert "Upgrade Notes\n-------------\n- upgrade notes\n" in out
+    assert out.index("1.0.0 (") < out.index("The first one.")
+    assert "- feature 0.0" in out
+
+    # reno's config file, names and all
+    os.mkdir("releasenotes/other")
+    os.rename(
+        "releasenotes/notes/note-0-0-0000000000000000.yaml", "releasenotes/other/a.yaml"
+    )
+    with open("releasenotes/config.yaml", "w", encoding="utf8") as fh:
+        yaml.dump(
+            {
+                "notesdir": "other",
+                "prelude_section_name": "prelude",
+                "release_tag_re": "((?:v?[\\d.]|rc)+)  # versions, verbose like reno",
+                "sections": [["features", "Shiny"]],
+                "collapse_pre_releases": True,
+            },
+            fh,
+        )
+    r.git("add", "releasenotes")
+    r = Runner(parse_args(["--reno", "--yaml"]))
+    assert r.notes_dir == "releasenotes/other"
+    r.run()
+    res = yaml.safe_load(capsys.readouterr().out)
+    assert res["Uncommitted"]["prelude"][0]["note"] == "The first one."
+    Runner(parse_args(["--reno", "--lint"])).run()
+
+    # a section reno doesn't know about either
+    with open("releasenotes/other/b.yaml", "w", encoding="utf8") as fh:
+        fh.write("fixes:\n  - nope\n")
+    with pytest.raises(AssertionError, match="fixes is not a valid section"):
+        Runner(parse_args(["--reno", "--lint"])).run()
+
+
+def test_reno_benchmark(capsys, tmp_run):
+    pytest.importorskip("reno")
+    r = tmp_run
+    releases = 30
+    per_release = 10
+    gen_reno_tree(
+        r,
+        [{"features": ["feature %d.%d"], "fixes": ["fix %d.%d"]}] * releases,
+        per_release,
+    )
+
+    start = time.perf_counter()
+    Runner(parse_args(["--reno", "--previous", "TAIL"])).run()
+    ours = time.perf_counter() - start
+    out = capsys.readouterr().out
+
+    start = time.perf_counter()
+    reno = subprocess.run(
+        [sys.executable, "-c", "import sys, reno.main; sys.exit(reno.main.main())"]
+        + ["report", "."],
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        encoding="utf8",
+    ).stdout
+    theirs = time.perf_counter() - start
+
+    # printed, not asserted: wall time depends on the machine, run with -s
+    with capsys.disabled():
+        print(
+            "\n%d notes, %d releases: rnotes %.3fs, reno %.3fs"
+            % (releases * per_release, releases, ours, theirs)
+        )
+    for num in range(releases):
+        for i in range(per_release):
+            assert "feature %d.%d\n" % (num, i) in out
+            assert "fix %d.%d\n" % (num, i) in reno
+
+
 def test_blame(capsys, tmp_run_with_notes):
     r = tmp_run_with_notes
     os.unlink(os.path.join(r.notes_dir, "note1.yaml"))
@@ -332,11 +1321,11 @@ def test_create(tmp_run, capsys, monkeypatch):
 def mock_git(runner, regex, result):
     func = runner.git
 
-    def new_git(*args):
+    def new_git(*args, **kwargs):
         cmd = " ".join(args)
         if re.match(regex, cmd):
             return result
-        return func(*args)
+        return func(*args, **kwargs)
 
     runner.git = new_git
     yield
@@ -438,3 +1427,9 @@ def test_args():
         ["--version", "4.5.6", "--debug", "--previous", "4.5.1", "--blame"]
     )
     assert args.blame
+    args = parse_args(
+        ["--since", "90 days ago", "--author", "bob", "--sections", "fixes,upgrade"]
+    )
+    assert args.since == "90 days ago"
+    assert args.author == "bob"
+    assert args.sections == "fixes,upgrade"